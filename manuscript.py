@@ -54,7 +54,727 @@
 # In[1]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# hidden: code to import libraries, set up database connection, other initialization\nimport warnings\nwarnings.filterwarnings(\'ignore\')\n\nimport os\nimport sys\nimport datetime\nimport pandas as pd\nimport numpy as np\nimport scipy\nfrom scipy import signal\nfrom scipy.optimize import curve_fit\nfrom scipy.stats.distributions import t\nfrom matplotlib import pyplot as plt\nimport matplotlib as mpl\nfrom matplotlib import cm\nfrom matplotlib.colors import ListedColormap\nimport seaborn as sns\nfrom sqlalchemy import create_engine\nimport sqlalchemy\nimport psycopg2\nfrom datetime import timedelta\nfrom IPython.display import display, HTML, Markdown\nimport cache_magic\nfrom tabulate import tabulate\n\n# our database connection\nredshift_engine = create_engine(os.getenv("DATABASE_URL_REDSHIFT"))\n\n# graph style\nsns.set(style="ticks")\n\n# long print, wrap\npd.set_option(\'display.expand_frame_repr\', False)\n\n# read from file if available, else from db and save it in a file for next time\n# will also help have data files ready for archiving in zenodo \ndef read_from_file_or_db(varname, query, skip_cache=False):\n    filename = "data/{}.csv".format(varname)\n    my_dataframe = pd.DataFrame()\n    try:\n        if not skip_cache:\n            my_dataframe = pd.read_csv(filename)\n    except IOError:\n        pass\n    if my_dataframe.empty:\n        global redshift_engine\n        my_dataframe = pd.read_sql_query(sqlalchemy.text(query), redshift_engine)\n        my_dataframe.to_csv(filename, index=False)  # cache for the future\n\n    return my_dataframe.copy()\n\n\n# make figure captions work.  use like this: \n# make a code cell, and include\n#   register_new_figure("my-figure-anchor-name") \n# before you want to refer to a figure.  This is where the link will go to.\n# and then in text markdown to refer to the figure\n#   {{figure_link("my-figure-anchor-name")}}\n\nglobal figure_so_far\nglobal figure_numbers\nfigures_so_far = 1\nfigure_numbers = {}\n\n# inspired by https://github.com/l-althueser/nbindex-jupyter/blob/master/nbindex/numbered.py\ndef leave_figure_anchor(anchor_text):\n    key  = u"figure-{}".format(anchor_text)\n    """\n    Adds numbered named object HTML anchors. Link to them in MarkDown using: [to keyword 1](#keyword-1)\n    """\n    return display(HTML(\'\'\'<div id="%s"></div>\n    <script>\n    var key = "%s"\n    $("div").each(function(i){\n        if (this.id === key){\n            this.innerHTML = \'<a name="\' + key + \'"></a>\';\n        }\n    });\n    </script>\n    \'\'\' % (key,key)))\n\ndef register_new_figure(anchor_text):\n    global figures_so_far\n    global figure_numbers\n    if not anchor_text in figure_numbers:\n        figure_numbers[anchor_text] = figures_so_far\n        leave_figure_anchor(anchor_text)\n        figures_so_far += 1\n    return figure_numbers[anchor_text]\n\ndef figure_link(anchor_text=None):\n    if anchor_text:\n        template = "[Figure {figure_number}](#figure-{anchor_text})"\n        my_return = template.format(figure_number=figure_numbers[anchor_text], \n                                    anchor_text=anchor_text)\n    else:\n        my_return = figure_numbers\n    return my_return\n    \n\n# set up colors\noa_status_order = ["green", "gold", "hybrid", "bronze", "closed"]\noa_status_colors = ["green", "gold", "orange", "brown", "grey"]\noa_color_lookup = pd.DataFrame(data = {"name": oa_status_order, "color": oa_status_colors, "order": range(0, len(oa_status_order))})\nmy_cmap = sns.color_palette(oa_status_colors)\n\ngraph_type_order = ["green", "gold", "hybrid", "immediate_bronze", "delayed_bronze", "closed"]\ngraph_type_colors = ["green", "gold", "orange", "brown", "salmon", "gray"]\ngraph_type_lookup = pd.DataFrame(data = {"name": graph_type_order, "color": graph_type_colors, "order": range(0, len(graph_type_order))})\nmy_cmap_graph_type = sns.color_palette(graph_type_colors)\n\ngraph_type_colors_plus_biorxiv = ["lawngreen"] + graph_type_colors\ngraph_type_order_plus_biorxiv = ["biorxiv"] + graph_type_order\nplus_biorxiv_labels = [\n    "green (biorxiv)",\n    "green (other)",\n    "gold",\n    "hybrid",\n    "bronze (immediate)",\n    "bronze (delayed)",\n    "closed"\n]\ngraph_type_plus_biorxiv_lookup = pd.DataFrame(data = {"name": graph_type_order_plus_biorxiv, "color": graph_type_colors_plus_biorxiv, "order": range(0, len(graph_type_colors_plus_biorxiv))})\nmy_cmap_graph_type_plus_biorxiv = sns.color_palette(graph_type_colors_plus_biorxiv)')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# hidden: code to import libraries, set up database connection, other initialization\nimport warnings\nwarnings.filterwarnings(\'ignore\')\n\nimport os\nimport sys\nimport time\nimport datetime\nimport atexit\nimport importlib\nimport collections\nfrom datetime import timedelta\n\nsetup_start_time = time.time()\n\n# set FUTURE_OA_HEADLESS=1 to run without a notebook front end (like\n# FUTURE_OA_HEADLESS=1 ipython manuscript.py) and get to the numbers quickly:\n# scipy, plotting, the database driver and the notebook helpers are only\n# imported when something first uses them, figures are drawn off screen, and\n# the import times are printed at the start and end of the run.\nheadless = os.getenv("FUTURE_OA_HEADLESS", "") not in ("", "0")\nif headless:\n    os.environ.setdefault("MPLBACKEND", "Agg")\n\n# seconds each module took to import, in the order they were imported\nimport_times = collections.OrderedDict()\n\ndef timed_import(module_name):\n    start_time = time.time()\n    module = importlib.import_module(module_name)\n    import_times.setdefault(module_name, time.time() - start_time)\n    return module\n\n# stands in for a module, or a name in one, and imports it on first use\nclass LazyImport(object):\n    def __init__(self, module_name, attribute=None, on_import=None):\n        self._module_name = module_name\n        self._attribute = attribute\n        self._on_import = on_import\n        self._value = None\n\n    def _load(self):\n        if self._value is None:\n            value = timed_import(self._module_name)\n            if self._attribute:\n                value = getattr(value, self._attribute)\n            if self._on_import:\n                self._on_import(value)\n            self._value = value\n        return self._value\n\n    def __getattr__(self, name):\n        return getattr(self._load(), name)\n\n    def __call__(self, *args, **kwargs):\n        return self._load()(*args, **kwargs)\n\ndef deferred_import(module_name, attribute=None, on_import=None):\n    if headless:\n        return LazyImport(module_name, attribute, on_import)\n    value = timed_import(module_name)\n    if attribute:\n        value = getattr(value, attribute)\n    if on_import:\n        on_import(value)\n    return value\n\ndef import_time_report():\n    my_return = pd.DataFrame({"module": list(import_times.keys()), "seconds": list(import_times.values())})\n    return my_return.sort_values("seconds", ascending=False).reset_index(drop=True)\n\npd = timed_import("pandas")\nnp = timed_import("numpy")\nscipy = deferred_import("scipy")\nsignal = deferred_import("scipy.signal")\ncurve_fit = deferred_import("scipy.optimize", "curve_fit")\nt = deferred_import("scipy.stats.distributions", "t")\nplt = deferred_import("matplotlib.pyplot")\nmpl = deferred_import("matplotlib")\ncm = deferred_import("matplotlib.cm")\nListedColormap = deferred_import("matplotlib.colors", "ListedColormap")\n# graph style\nsns = deferred_import("seaborn", on_import=lambda sns: sns.set(style="ticks"))\ncreate_engine = deferred_import("sqlalchemy", "create_engine")\nsqlalchemy = deferred_import("sqlalchemy")\npsycopg2 = deferred_import("psycopg2")\ndisplay = deferred_import("IPython.display", "display")\nHTML = deferred_import("IPython.display", "HTML")\nMarkdown = deferred_import("IPython.display", "Markdown")\ntabulate = deferred_import("tabulate", "tabulate")\n\n# our database connection, made the first time a query needs it.  the pool is\n# sized so prefetch_datasets can run this many queries at once.  there\'s none\n# when running against a local warehouse (FUTURE_OA_LOCAL_WAREHOUSE) or only\n# from the cached data files\nprefetch_max_workers = int(os.getenv("FUTURE_OA_PREFETCH_WORKERS", "8"))\nredshift_engine = None\n\ndef get_redshift_engine():\n    global redshift_engine\n    if redshift_engine is None:\n        if not os.getenv("DATABASE_URL_REDSHIFT"):\n            raise ValueError("set DATABASE_URL_REDSHIFT (or FUTURE_OA_LOCAL_WAREHOUSE) to run queries that aren\'t cached")\n        redshift_engine = create_engine(os.getenv("DATABASE_URL_REDSHIFT"), pool_size=prefetch_max_workers, max_overflow=0, pool_pre_ping=True)\n    return redshift_engine\n\n# long print, wrap\npd.set_option(\'display.expand_frame_repr\', False)\n\n# copy-on-write (always on from pandas 3), so datasets can be handed out as\n# views: changing one copies just what\'s changed, never the shared data\nif int(pd.__version__.split(".")[0]) < 3:\n    pd.set_option("mode.copy_on_write", True)\n\n# collects the pieces of a result and makes one frame of them at the end, with\n# the same columns and index DataFrame.append would have given (which copied\n# everything so far on every call, and is gone from pandas 2).  add a frame,\n# or columns as keywords, either one value each or equal-length lists:\n#   my_builder = FrameBuilder()\n#   for year in years:\n#       my_builder.add(prediction_year=year, num_articles=count(year))\n#   my_return = my_builder.build()\n# columns added one row at a time are kept as lists, and only made into a frame\n# when build() is called\nclass FrameBuilder(object):\n    def __init__(self):\n        self._pieces = []\n\n    def add(self, piece=None, **columns):\n        if piece is None:\n            columns = collections.OrderedDict((name, np.atleast_1d(value)) for name, value in columns.items())\n            num_rows = max([len(value) for value in columns.values()] + [0])\n            last_piece = self._pieces[-1] if self._pieces else None\n            if not isinstance(last_piece, collections.OrderedDict) or list(last_piece) != ["__index__"] + list(columns):\n                last_piece = collections.OrderedDict([("__index__", [])] + [(name, []) for name in columns])\n                self._pieces.append(last_piece)\n            last_piece["__index__"].append(np.arange(num_rows))\n            for name, value in columns.items():\n                if len(value) == 1:\n                    value = np.repeat(value, num_rows)\n                last_piece[name].append(value)\n        elif len(piece.columns) or len(piece.index):\n            self._pieces.append(piece)\n\n    def build(self):\n        frames = []\n        for piece in self._pieces:\n            if isinstance(piece, collections.OrderedDict):\n                index = np.concatenate(piece.pop("__index__"))\n                piece = pd.DataFrame(collections.OrderedDict((name, np.concatenate(values)) for name, values in piece.items()), index=index)\n            frames.append(piece)\n        self._pieces = frames\n        if not frames:\n            return pd.DataFrame()\n        return pd.concat(frames)\n\n\n# make figure captions work.  use like this: \n# make a code cell, and include\n#   register_new_figure("my-figure-anchor-name") \n# before you want to refer to a figure.  This is where the link will go to.\n# and then in text markdown to refer to the figure\n#   {{figure_link("my-figure-anchor-name")}}\n\nglobal figure_so_far\nglobal figure_numbers\nfigures_so_far = 1\nfigure_numbers = {}\n\n# inspired by https://github.com/l-althueser/nbindex-jupyter/blob/master/nbindex/numbered.py\ndef leave_figure_anchor(anchor_text):\n    key  = u"figure-{}".format(anchor_text)\n    """\n    Adds numbered named object HTML anchors. Link to them in MarkDown using: [to keyword 1](#keyword-1)\n    """\n    return display(HTML(\'\'\'<div id="%s"></div>\n    <script>\n    var key = "%s"\n    $("div").each(function(i){\n        if (this.id === key){\n            this.innerHTML = \'<a name="\' + key + \'"></a>\';\n        }\n    });\n    </script>\n    \'\'\' % (key,key)))\n\ndef register_new_figure(anchor_text):\n    global figures_so_far\n    global figure_numbers\n    if not anchor_text in figure_numbers:\n        figure_numbers[anchor_text] = figures_so_far\n        leave_figure_anchor(anchor_text)\n        figures_so_far += 1\n    return figure_numbers[anchor_text]\n\ndef figure_link(anchor_text=None):\n    if anchor_text:\n        template = "[Figure {figure_number}](#figure-{anchor_text})"\n        my_return = template.format(figure_number=figure_numbers[anchor_text], \n                                    anchor_text=anchor_text)\n    else:\n        my_return = figure_numbers\n    return my_return\n    \n\n# set up colors.  headless, the palettes are left as color names, which\n# seaborn turns into the same palettes when it draws\ndef make_palette(colors):\n    if headless:\n        return colors\n    return sns.color_palette(colors)\n\noa_status_order = ["green", "gold", "hybrid", "bronze", "closed"]\noa_status_colors = ["green", "gold", "orange", "brown", "grey"]\noa_color_lookup = pd.DataFrame(data = {"name": oa_status_order, "color": oa_status_colors, "order": range(0, len(oa_status_order))})\nmy_cmap = make_palette(oa_status_colors)\n\ngraph_type_order = ["green", "gold", "hybrid", "immediate_bronze", "delayed_bronze", "closed"]\ngraph_type_colors = ["green", "gold", "orange", "brown", "salmon", "gray"]\ngraph_type_lookup = pd.DataFrame(data = {"name": graph_type_order, "color": graph_type_colors, "order": range(0, len(graph_type_order))})\nmy_cmap_graph_type = make_palette(graph_type_colors)\n\ngraph_type_colors_plus_biorxiv = ["lawngreen"] + graph_type_colors\ngraph_type_order_plus_biorxiv = ["biorxiv"] + graph_type_order\nplus_biorxiv_labels = [\n    "green (biorxiv)",\n    "green (other)",\n    "gold",\n    "hybrid",\n    "bronze (immediate)",\n    "bronze (delayed)",\n    "closed"\n]\ngraph_type_plus_biorxiv_lookup = pd.DataFrame(data = {"name": graph_type_order_plus_biorxiv, "color": graph_type_colors_plus_biorxiv, "order": range(0, len(graph_type_colors_plus_biorxiv))})\nmy_cmap_graph_type_plus_biorxiv = make_palette(graph_type_colors_plus_biorxiv)\n\nif headless:\n    print("setup imports took {:.1f}s:".format(time.time() - setup_start_time))\n    print(import_time_report().to_string(index=False))\n    atexit.register(lambda: print("imports over the whole run:\\n{}".format(import_time_report().to_string(index=False))))\n')
+
+
+# In[ ]:
+
+
+# read from file if available, else from db and save it in a file for next time
+# will also help have data files ready for archiving in zenodo
+#
+# the cache is parquet (typed, compressed, columnar) when pyarrow is installed,
+# so loaders can ask for just the columns and rows they need.  the csv files
+# from the zenodo dump are still read if there is no parquet file yet.
+#
+# data/cache_manifest.json records a fingerprint of the query that made each
+# cached file, so editing a query invalidates its cached copy automatically.
+#
+# set FUTURE_OA_SHARED_CACHE=1 when several notebooks or batch jobs share one
+# data/ directory: a missing entry is then computed by one process while the
+# others wait for it, and cached files are checked against their checksum.
+# files are always written to a temp file and renamed into place, so a crashed
+# run can't leave a truncated file behind.
+import operator
+import shutil
+import hashlib
+import json
+import uuid
+import contextlib
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.dataset
+except ImportError:
+    pyarrow = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+cache_dir = "data"
+cache_compression = "zstd"
+shared_cache = os.getenv("FUTURE_OA_SHARED_CACHE", "") not in ("", "0")
+
+# queries for the datasets loaded in the Code: SQL section, by varname
+dataset_queries = collections.OrderedDict()
+# queries for the article-level datasets, which are derived from the one
+# article_rollup query rather than each run on their own
+rollup_dataset_queries = collections.OrderedDict()
+# called with no arguments whenever a dataset is re-registered or unloaded
+# (see register_dataset), so anything computed from the datasets can be thrown
+# away.  made here, before the cells that compute from the datasets add theirs
+dataset_change_hooks = []
+
+# filters are (column, op, value) tuples, and-ed together, same as pyarrow takes
+filter_operators = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda column, value: column.isin(value),
+    "not in": lambda column, value: ~column.isin(value)
+}
+
+def get_cache_filename(varname, file_format):
+    return os.path.join(cache_dir, "{}.{}".format(varname, file_format))
+
+# where the cache for varname is (or will be) kept
+def get_cache_path(varname):
+    if pyarrow:
+        return get_cache_filename(varname, "parquet")
+    return get_cache_filename(varname, "csv")
+
+def filter_dataframe(my_dataframe, filters=None):
+    if not filters:
+        return my_dataframe
+    mask = np.ones(len(my_dataframe), dtype=bool)
+    for (column, op, value) in filters:
+        mask &= np.asarray(filter_operators[op](my_dataframe[column], value))
+    return my_dataframe.loc[mask]
+
+def read_cache_file(varname, columns=None, filters=None):
+    parquet_filename = get_cache_filename(varname, "parquet")
+    csv_filename = get_cache_filename(varname, "csv")
+
+    if pyarrow and os.path.exists(parquet_filename):
+        my_dataframe = pd.read_parquet(parquet_filename, columns=columns, filters=filters or None)
+        # partition columns come back as categoricals
+        for column in my_dataframe.columns:
+            if isinstance(my_dataframe[column].dtype, pd.CategoricalDtype):
+                my_dataframe[column] = my_dataframe[column].astype(my_dataframe[column].cat.categories.dtype)
+        return my_dataframe
+
+    if os.path.exists(csv_filename):
+        my_dataframe = pd.read_csv(csv_filename)
+        my_dataframe = filter_dataframe(my_dataframe, filters)
+        if columns is not None:
+            my_dataframe = my_dataframe[columns]
+        return my_dataframe
+
+    return read_archive_member(varname, columns, filters)
+
+def get_cache_num_rows(varname):
+    return len(read_cache_file(varname, columns=[]))
+
+def get_cache_num_bytes(filename):
+    if not os.path.isdir(filename):
+        return os.path.getsize(filename)
+    return sum([os.path.getsize(os.path.join(root, name)) for (root, dirs, names) in os.walk(filename) for name in names])
+
+def get_cache_checksum(filename):
+    checksum = hashlib.sha256()
+    if os.path.isdir(filename):
+        filenames = sorted([os.path.join(root, name) for (root, dirs, names) in os.walk(filename) for name in names])
+    else:
+        filenames = [filename]
+    for part_filename in filenames:
+        checksum.update(os.path.relpath(part_filename, filename).encode("utf-8"))
+        with open(part_filename, "rb") as part_file:
+            for block in iter(lambda: part_file.read(1024 * 1024), b""):
+                checksum.update(block)
+    return checksum.hexdigest()
+
+def make_dirs(dirname):
+    try:
+        os.makedirs(dirname)
+    except OSError:
+        if not os.path.isdir(dirname):
+            raise
+
+# only one thread at a time gets the lock for a name, and in shared cache mode
+# only one process
+cache_thread_locks = collections.defaultdict(threading.Lock)
+cache_thread_locks_lock = threading.Lock()
+
+def get_thread_lock(name):
+    with cache_thread_locks_lock:
+        return cache_thread_locks[name]
+
+@contextlib.contextmanager
+def cache_lock(name):
+    with get_thread_lock(name):
+        if shared_cache and fcntl:
+            with cache_file_lock(name):
+                yield
+        else:
+            yield
+
+@contextlib.contextmanager
+def cache_file_lock(name):
+    lock_dir = os.path.join(cache_dir, ".locks")
+    make_dirs(lock_dir)
+    lock_filename = os.path.join(lock_dir, "{}.lock".format(name.replace("/", "__")))
+    with open(lock_filename, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# write next to the destination, then rename it into place.  a file is
+# renamed over the old one.  a directory (a partitioned cache) can't be, so
+# the old one is renamed aside first and only deleted once the new one is in
+# place.  readers can find nothing there between the two renames, but never a
+# half-deleted cache, and if it stops in between the old one is still in
+# <filename>.<id>.old
+def write_and_replace(filename, write_function):
+    make_dirs(os.path.dirname(filename))
+    write_id = uuid.uuid4().hex
+    tmp_filename = "{}.{}.tmp".format(filename, write_id)
+    old_filename = "{}.{}.old".format(filename, write_id)
+    try:
+        write_function(tmp_filename)
+        if os.path.isdir(filename):
+            os.replace(filename, old_filename)
+            try:
+                os.replace(tmp_filename, filename)
+            except OSError:
+                os.replace(old_filename, filename)
+                raise
+        else:
+            os.replace(tmp_filename, filename)
+    finally:
+        for leftover_filename in [tmp_filename, old_filename]:
+            if os.path.isdir(leftover_filename):
+                shutil.rmtree(leftover_filename)
+            elif os.path.exists(leftover_filename):
+                os.remove(leftover_filename)
+    return filename
+
+# a result with no rows.  partitioned, it's still a dataset directory, with one
+# empty file of the columns (the partition columns last, where they're read
+# back), so it reads back the way one with rows does
+def write_empty_parquet(filename, schema=None, partition_cols=None):
+    schema = schema or pyarrow.schema([])
+    if partition_cols:
+        schema = pyarrow.schema([field for field in schema if field.name not in partition_cols] +
+                                [field for field in schema if field.name in partition_cols])
+        make_dirs(filename)
+        filename = os.path.join(filename, "part-0.parquet")
+    pyarrow.parquet.write_table(schema.empty_table(), filename, compression=cache_compression)
+
+def write_cache_file(varname, my_dataframe, partition_cols=None):
+    if pyarrow and partition_cols and my_dataframe.empty:
+        schema = pyarrow.Schema.from_pandas(my_dataframe, preserve_index=False).remove_metadata()
+        write_function = lambda filename: write_empty_parquet(filename, schema, partition_cols)
+    elif pyarrow:
+        write_function = lambda filename: my_dataframe.to_parquet(filename, index=False, compression=cache_compression, partition_cols=partition_cols)
+    else:
+        write_function = lambda filename: my_dataframe.to_csv(filename, index=False)
+    return write_and_replace(get_cache_path(varname), write_function)
+
+# whitespace and full-line comments don't change what a query returns, so
+# they don't change its fingerprint either
+def get_query_fingerprint(query, params=None, aggregate_by=None):
+    lines = [line.strip() for line in query.strip().split("\n")]
+    normalized_query = " ".join([line for line in lines if line and not line.startswith("--")])
+    normalized_query = " ".join(normalized_query.split())
+    normalized_params = json.dumps(params or {}, sort_keys=True, default=str)
+    if aggregate_by:
+        # a folded result is a different dataset than the raw rows
+        normalized_params += json.dumps({"aggregate_by": list(aggregate_by)})
+    return hashlib.sha1(u"{}\n{}".format(normalized_query, normalized_params).encode("utf-8")).hexdigest()
+
+def get_cache_manifest_filename():
+    return os.path.join(cache_dir, "cache_manifest.json")
+
+def read_cache_manifest():
+    if not os.path.exists(get_cache_manifest_filename()):
+        return {}
+    with open(get_cache_manifest_filename()) as manifest_file:
+        return json.load(manifest_file)
+
+def write_cache_manifest(manifest):
+    def write_function(filename):
+        with open(filename, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    write_and_replace(get_cache_manifest_filename(), write_function)
+
+def record_cache_entry(varname, fingerprint, num_rows=None):
+    filename = get_cache_path(varname)
+    if not os.path.exists(filename):
+        filename = get_cache_filename(varname, "csv")
+    if num_rows is None:
+        num_rows = get_cache_num_rows(varname)
+    entry = {
+        "fingerprint": fingerprint,
+        "filename": filename,
+        "num_rows": int(num_rows),
+        "num_bytes": get_cache_num_bytes(filename),
+        "checksum": get_cache_checksum(filename),
+        "created": datetime.datetime.utcfromtimestamp(os.path.getmtime(filename)).isoformat()
+    }
+    with cache_lock("cache_manifest"):
+        manifest = read_cache_manifest()
+        manifest[varname] = entry
+        write_cache_manifest(manifest)
+    return entry
+
+def cache_manifest_report():
+    manifest = read_cache_manifest()
+    my_return = pd.DataFrame.from_dict(manifest, orient="index")
+    my_return.index.name = "varname"
+    return my_return.sort_index()
+
+# returns None if there is nothing usable cached for this query
+def read_cached_query(varname, fingerprint, columns=None, filters=None, verbose=True):
+    entry = read_cache_manifest().get(varname)
+    if entry and entry["fingerprint"] != fingerprint:
+        if verbose:
+            print("query for {} has changed since it was cached, rerunning it".format(varname))
+        return None
+    if shared_cache and entry and os.path.exists(entry["filename"]):
+        if get_cache_checksum(entry["filename"]) != entry["checksum"]:
+            if verbose:
+                print("cached file for {} doesn't match its checksum, rerunning the query".format(varname))
+            return None
+
+    csv_filename = get_cache_filename(varname, "csv")
+    if pyarrow and os.path.exists(csv_filename) and not os.path.exists(get_cache_path(varname)):
+        csv_dataframe = pd.read_csv(csv_filename)
+        if not csv_dataframe.empty:
+            write_cache_file(varname, csv_dataframe)  # so the next start skips the csv parse
+            entry = None
+
+    my_dataframe = read_cache_file(varname, columns, filters)
+    if my_dataframe is None or (my_dataframe.empty and not filters):
+        return None
+    if entry is None and cache_file_exists(varname, include_archive=False):
+        # from the zenodo dump, or cached before there was a manifest
+        record_cache_entry(varname, fingerprint)
+    return my_dataframe
+
+# for results too big to hold in memory: read them chunksize rows at a time
+# from the query backend, writing each chunk to the cache file as it comes.
+# with aggregate_by, chunks are instead folded into a running sum grouped by
+# those columns, and only the aggregate is cached.  returns the number of rows
+# cached.
+def stream_query_to_cache(varname, query, params=None, chunksize=100000, partition_cols=None, aggregate_by=None):
+    chunks = run_query_in_chunks(query, params, chunksize)
+    if aggregate_by:
+        aggregate_by = list(aggregate_by)
+        my_dataframe = None
+        for chunk in chunks:
+            if my_dataframe is not None:
+                chunk = pd.concat([my_dataframe, chunk], ignore_index=True)
+            my_dataframe = chunk.groupby(aggregate_by, as_index=False, dropna=False).sum(numeric_only=True)
+        if my_dataframe is None:
+            my_dataframe = pd.DataFrame()
+        write_cache_file(varname, my_dataframe, partition_cols)
+        return len(my_dataframe)
+
+    row_counts = []
+    def counted_chunks():
+        for chunk in chunks:
+            row_counts.append(len(chunk))
+            yield chunk
+
+    if pyarrow:
+        # the schema comes from the first chunk, later chunks are cast to it
+        def write_function(filename):
+            schema = None
+            writer = None
+            write_options = pyarrow.dataset.ParquetFileFormat().make_write_options(compression=cache_compression)
+            for i, chunk in enumerate(counted_chunks()):
+                if schema is None:
+                    schema = pyarrow.Schema.from_pandas(chunk, preserve_index=False).remove_metadata()
+                table = pyarrow.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                if partition_cols:
+                    pyarrow.dataset.write_dataset(
+                        table, filename, format="parquet", file_options=write_options,
+                        partitioning=partition_cols, partitioning_flavor="hive",
+                        basename_template="part-{}-{{i}}.parquet".format(i),
+                        existing_data_behavior="overwrite_or_ignore")
+                else:
+                    if writer is None:
+                        writer = pyarrow.parquet.ParquetWriter(filename, schema, compression=cache_compression)
+                    writer.write_table(table)
+            if writer is not None:
+                writer.close()
+            elif not sum(row_counts):
+                write_empty_parquet(filename, schema, partition_cols)
+    else:
+        def write_function(filename):
+            for i, chunk in enumerate(counted_chunks()):
+                chunk.to_csv(filename, index=False, mode="w" if i == 0 else "a", header=(i == 0))
+    write_and_replace(get_cache_path(varname), write_function)
+    return sum(row_counts)
+
+def read_from_file_or_db(varname, query, skip_cache=False, columns=None, filters=None, partition_cols=None, params=None,
+                         chunksize=None, aggregate_by=None):
+    fingerprint = get_query_fingerprint(query, params, aggregate_by)
+    my_dataframe = None
+    if not skip_cache:
+        my_dataframe = read_cached_query(varname, fingerprint, columns, filters)
+
+    if my_dataframe is None:
+        with cache_lock(varname):
+            if not skip_cache:
+                # someone else may have filled it in while we waited for the lock
+                my_dataframe = read_cached_query(varname, fingerprint, columns, filters, verbose=False)
+            if my_dataframe is None and (chunksize or aggregate_by):
+                start_time = time.time()
+                num_rows = stream_query_to_cache(varname, query, params, chunksize or 100000, partition_cols, aggregate_by)
+                query_timings[varname] = time.time() - start_time
+                record_cache_entry(varname, fingerprint, num_rows=num_rows)
+                my_dataframe = read_cache_file(varname, columns, filters)
+            elif my_dataframe is None:
+                start_time = time.time()
+                my_dataframe = run_query(query, params)
+                query_timings[varname] = time.time() - start_time
+                write_cache_file(varname, my_dataframe, partition_cols)  # cache for the future
+                record_cache_entry(varname, fingerprint, num_rows=len(my_dataframe))
+                my_dataframe = filter_dataframe(my_dataframe, filters)
+                if columns is not None:
+                    my_dataframe = my_dataframe[columns]
+
+    return add_sample_standard_errors(my_dataframe)
+
+def cache_file_exists(varname, include_archive=True):
+    if os.path.exists(get_cache_path(varname)) or os.path.exists(get_cache_filename(varname, "csv")):
+        return True
+    return include_archive and get_archive_member(varname) is not None
+
+def is_query_cached(varname, query, params=None):
+    entry = read_cache_manifest().get(varname)
+    if entry:
+        return entry["fingerprint"] == get_query_fingerprint(query, params) and os.path.exists(entry["filename"])
+    return cache_file_exists(varname)
+
+# run all the queries that aren't cached yet, several at a time, so the loads
+# after this only read files.  each query is retried with backoff before
+# giving up on it; the ones that still failed are raised at the end.
+def prefetch_datasets(queries, max_workers=None, retries=3, backoff_seconds=10):
+    max_workers = max_workers or prefetch_max_workers
+    missing_varnames = [varname for varname in queries if not is_query_cached(varname, queries[varname])]
+    if not missing_varnames:
+        return []
+    print("prefetching {} of {} datasets, {} at a time".format(len(missing_varnames), len(queries), max_workers))
+
+    query_errors = get_query_errors()
+    def fetch(varname):
+        for attempt in range(retries + 1):
+            try:
+                read_from_file_or_db(varname, queries[varname])
+                return
+            except query_errors:
+                if attempt == retries:
+                    raise
+                time.sleep(backoff_seconds * 2 ** attempt)
+
+    start_time = time.time()
+    failed_varnames = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = dict([(executor.submit(fetch, varname), varname) for varname in missing_varnames])
+        for i, future in enumerate(as_completed(futures)):
+            varname = futures[future]
+            status = "done"
+            if future.exception():
+                failed_varnames.append(varname)
+                status = "FAILED: {}".format(future.exception())
+            print("[{}/{}, {:.0f}s] {} {}".format(i + 1, len(missing_varnames), time.time() - start_time, varname, status))
+
+    if failed_varnames:
+        raise RuntimeError("couldn't prefetch {}".format(", ".join(failed_varnames)))
+    return missing_varnames
+
+
+# In[ ]:
+
+
+# where queries run.  by default that's redshift (DATABASE_URL_REDSHIFT).  set
+# FUTURE_OA_LOCAL_WAREHOUSE to a directory of parquet extracts of the tables
+# below (unpaywall.parquet, or a directory of parquet files per table) to run
+# the same query strings locally in duckdb instead.  the few redshift-isms the
+# queries use are shimmed, see translate_redshift_sql.
+#
+# query results from the local warehouse are cached under data/local rather
+# than data, so they never overwrite the results from the real warehouse.
+# set FUTURE_OA_CACHE_DIR to put them somewhere else.
+import re
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+local_warehouse_dir = os.getenv("FUTURE_OA_LOCAL_WAREHOUSE")
+local_warehouse_tables = [
+    "unpaywall",
+    "unpaywall_updates_view",
+    "journal_delayed_oa_active",
+    "papertrail_unpaywall_extracted",
+    "unpaywall_pmh_record_min_timestamp"
+]
+local_warehouse_connection = None
+
+if local_warehouse_dir:
+    cache_dir = os.getenv("FUTURE_OA_CACHE_DIR", os.path.join("data", "local"))
+else:
+    cache_dir = os.getenv("FUTURE_OA_CACHE_DIR", cache_dir)
+
+# how long each query took, by varname, for benchmarking queries
+query_timings = collections.OrderedDict()
+
+def get_query_backend():
+    if local_warehouse_dir:
+        return "local"
+    return "redshift"
+
+# the errors a query can fail with on the current backend, which are worth
+# retrying.  locally that's duckdb's, so sqlalchemy isn't imported for them
+def get_query_errors():
+    if get_query_backend() == "local":
+        return (duckdb.Error, IOError) if duckdb else (IOError,)
+    return (sqlalchemy.exc.DBAPIError, IOError)
+
+# the articles queries compare a year with a timestamp, which redshift takes
+# and duckdb doesn't, so compare years with years
+redshift_sql_shims = [
+    (re.compile(r"(\w*year)\s*([<>]=?|=|!=)\s*'(\d{4})-01-01'::timestamp"), r"\1 \2 \3"),
+]
+
+def translate_redshift_sql(query, params=None):
+    for pattern, replacement in redshift_sql_shims:
+        query = pattern.sub(replacement, query)
+    # sqlalchemy style :name parameters become duckdb $name ones
+    for name in (params or {}):
+        query = re.sub(r"(?<![:\w]):{}\b".format(name), "${}".format(name), query)
+    return query
+
+def get_local_warehouse_connection():
+    global local_warehouse_connection
+    if local_warehouse_connection is None:
+        if duckdb is None:
+            raise ImportError("duckdb is needed to run queries against FUTURE_OA_LOCAL_WAREHOUSE")
+        connection = duckdb.connect()
+        # redshift has ADD_MONTHS, and strtol for get_sampled_query
+        connection.execute("create macro add_months(ts, n) as ts + to_months(cast(n as integer))")
+        connection.execute("create macro strtol(s, base) as case when base = 16 then ('0x' || s)::bigint end")
+        for table in local_warehouse_tables:
+            path = os.path.join(local_warehouse_dir, "{}.parquet".format(table))
+            if not os.path.exists(path) and os.path.isdir(os.path.join(local_warehouse_dir, table)):
+                path = os.path.join(local_warehouse_dir, table)
+            if os.path.isdir(path):
+                source = "read_parquet('{}', hive_partitioning = true)".format(os.path.join(path, "**", "*.parquet"))
+            elif os.path.exists(path):
+                source = "read_parquet('{}')".format(path)
+            else:
+                continue
+            connection.execute("create view {} as select * from {}".format(table, source))
+        local_warehouse_connection = connection
+    # a cursor per query, so prefetch_datasets threads don't share one.  and
+    # redshift divides integers as integers, which is a per cursor setting
+    my_connection = local_warehouse_connection.cursor()
+    my_connection.execute("set integer_division = true")
+    return my_connection
+
+def run_query(query, params=None):
+    query = get_sampled_query(query)
+    if get_query_backend() == "local":
+        my_connection = get_local_warehouse_connection()
+        try:
+            return scale_sampled_counts(my_connection.execute(translate_redshift_sql(query, params), params or {}).df())
+        finally:
+            my_connection.close()
+    return scale_sampled_counts(pd.read_sql_query(sqlalchemy.text(query), get_redshift_engine(), params=params))
+
+# yields the results of query as dataframes of about chunksize rows
+def run_query_in_chunks(query, params=None, chunksize=100000):
+    query = get_sampled_query(query)
+    if get_query_backend() == "local":
+        my_connection = get_local_warehouse_connection()
+        try:
+            my_connection.execute(translate_redshift_sql(query, params), params or {})
+            vectors_per_chunk = max(1, chunksize // 2048)
+            # an empty result is still one empty chunk, for its columns, the
+            # way pandas gives it from redshift
+            num_chunks = 0
+            while True:
+                chunk = my_connection.fetch_df_chunk(vectors_per_chunk)
+                if not len(chunk) and num_chunks:
+                    break
+                num_chunks += 1
+                yield scale_sampled_counts(chunk)
+                if not len(chunk):
+                    break
+        finally:
+            my_connection.close()
+        return
+    with get_redshift_engine().connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        for chunk in pd.read_sql_query(sqlalchemy.text(query), connection, params=params, chunksize=chunksize):
+            yield scale_sampled_counts(chunk)
+
+
+# In[ ]:
+
+
+# fast iteration: set FUTURE_OA_SAMPLE to a fraction like 0.01 or 0.1 to run
+# every query on that sample of unpaywall instead of all of it.  the sample is
+# by a hash of the doi, so it's the same articles every time and in every
+# query.  counts (the num_* columns) are scaled back up by the sample fraction,
+# and read_from_file_or_db adds a <column>_se column with the standard error of
+# each scaled count.  everything downstream runs on these as usual.  unset it
+# for the real run.
+#
+# the standard error assumes the counted rows were sampled independently.  for
+# views that isn't quite true, all the views of a sampled doi come together, so
+# take it as a lower bound there.
+#
+# sampled results are cached in their own directory, data/sample_0.01 etc.
+
+sample_fraction = None
+if os.getenv("FUTURE_OA_SAMPLE"):
+    sample_fraction = float(os.getenv("FUTURE_OA_SAMPLE"))
+    if not 0 < sample_fraction <= 1:
+        raise ValueError("FUTURE_OA_SAMPLE should be a fraction between 0 and 1, not {}".format(sample_fraction))
+sample_buckets = 10000
+
+if sample_fraction:
+    # round to the fraction the buckets actually give
+    sample_fraction = max(1, int(round(sample_fraction * sample_buckets))) / float(sample_buckets)
+    cache_dir = os.path.join(cache_dir, "sample_{}".format(sample_fraction))
+
+def get_sampled_query(query):
+    if not sample_fraction:
+        return query
+    sample_sql = "(select * from unpaywall where strtol(substring(md5(doi), 1, 8), 16) % {} < {}) u".format(
+        sample_buckets, int(round(sample_fraction * sample_buckets)))
+    # just the main unpaywall u, not other aliases like u_biorxiv_record that
+    # are joined to it by doi
+    return re.sub(r"\bunpaywall u\b", sample_sql, query)
+
+def get_count_columns(my_dataframe):
+    return [column for column in my_dataframe.columns if column.startswith("num_") and not column.endswith("_se")]
+
+def scale_sampled_counts(my_dataframe):
+    if sample_fraction:
+        for column in get_count_columns(my_dataframe):
+            my_dataframe[column] = my_dataframe[column] / sample_fraction
+    return my_dataframe
+
+# each scaled count is n / p for n sampled rows, with variance n (1 - p) / p^2
+def add_sample_standard_errors(my_dataframe):
+    if sample_fraction:
+        for column in get_count_columns(my_dataframe):
+            my_dataframe["{}_se".format(column)] = np.sqrt(my_dataframe[column] * (1 - sample_fraction) / sample_fraction)
+    return my_dataframe
+
+
+# In[ ]:
+
+
+# read the datasets straight out of the zenodo archive, without unpacking it
+# into data/ first: set FUTURE_OA_DATA_ARCHIVE to the downloaded .zip or .tar.
+# members are found by their path under data/, wherever the archive puts it,
+# and streamed from their offset in the archive.  a zip has its own index of
+# offsets at the end; for a tar we make one on first use and keep it next to
+# the cache (data/<archive name>.index.json), so later starts go straight to
+# the member instead of reading through the archive.  a compressed tar
+# (.tar.gz) still works but has to decompress up to each member, so use a zip
+# or plain tar for speed.
+#
+# the archive holds the full warehouse results, so it isn't used with
+# FUTURE_OA_LOCAL_WAREHOUSE or FUTURE_OA_SAMPLE.  anything cached in data/
+# still wins over the archive.
+import tarfile
+import zipfile
+
+data_archive = os.getenv("FUTURE_OA_DATA_ARCHIVE")
+if local_warehouse_dir or sample_fraction:
+    data_archive = None
+data_archive_index = None
+data_archive_zipfile = None
+
+def is_zip_archive(archive_filename):
+    return zipfile.is_zipfile(archive_filename)
+
+def get_data_archive_index_filename():
+    return os.path.join(cache_dir, "{}.index.json".format(os.path.basename(data_archive)))
+
+# member name -> where it is.  the index is only reused for the same archive
+# file, by size and modified time
+def get_data_archive_index():
+    global data_archive_index, data_archive_zipfile
+    if data_archive_index is not None:
+        return data_archive_index
+
+    archive_stat = [os.path.getsize(data_archive), os.path.getmtime(data_archive)]
+    members = None
+    if is_zip_archive(data_archive):
+        data_archive_zipfile = zipfile.ZipFile(data_archive)
+        members = dict([(info.filename, {"size": info.file_size}) for info in data_archive_zipfile.infolist()
+                        if not info.filename.endswith("/")])
+    elif os.path.exists(get_data_archive_index_filename()):
+        with open(get_data_archive_index_filename()) as index_file:
+            saved_index = json.load(index_file)
+        if saved_index["archive_stat"] == archive_stat:
+            members = saved_index["members"]
+    if members is None:
+        with tarfile.open(data_archive) as archive:
+            members = dict([(member.name, {"offset": member.offset_data, "size": member.size})
+                            for member in archive if member.isfile()])
+        def write_function(filename):
+            with open(filename, "w") as index_file:
+                json.dump({"archive_stat": archive_stat, "members": members}, index_file)
+        write_and_replace(get_data_archive_index_filename(), write_function)
+
+    # look members up by every trailing part of their path, so
+    # future-oa-data/data/views_by_age_years.csv is found as views_by_age_years.csv
+    data_archive_index = {}
+    for name in sorted(members):
+        parts = name[2:].split("/") if name.startswith("./") else name.split("/")
+        for i in range(len(parts)):
+            data_archive_index.setdefault("/".join(parts[i:]), dict(members[name], name=name))
+    return data_archive_index
+
+def get_archive_member(varname):
+    if not data_archive:
+        return None
+    index = get_data_archive_index()
+    for file_format in ["parquet", "csv"]:
+        member = index.get("{}.{}".format(varname, file_format))
+        if member:
+            return dict(member, file_format=file_format)
+    return None
+
+@contextlib.contextmanager
+def open_archive_member(member):
+    if data_archive_zipfile is not None:
+        with data_archive_zipfile.open(member["name"]) as member_file:
+            yield member_file
+    else:
+        with tarfile.open(data_archive) as archive:
+            tarinfo = tarfile.TarInfo(member["name"])
+            tarinfo.offset_data = member["offset"]
+            tarinfo.size = member["size"]
+            with archive.extractfile(tarinfo) as member_file:
+                yield member_file
+
+def read_archive_member(varname, columns=None, filters=None):
+    member = get_archive_member(varname)
+    if member is None:
+        return None
+    with open_archive_member(member) as member_file:
+        if member["file_format"] == "parquet":
+            my_dataframe = pd.read_parquet(member_file)
+        else:
+            my_dataframe = pd.read_csv(member_file)
+    my_dataframe = filter_dataframe(my_dataframe, filters)
+    if columns is not None:
+        my_dataframe = my_dataframe[columns]
+    return my_dataframe
 
 
 # The data in this analysis comes from two sources: (1) the Unpaywall dataset and (2) the access logs of the Unpaywall web browser extension.
@@ -201,7 +921,7 @@ register_new_figure("date_of_observation");
 # In[4]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\ndef get_data_extrapolated(graph_type, data_type=False, extrap="linear", now_delta_years=0, cumulative=True):\n    \n    calc_min_year = 1951\n    display_min_year = 2010\n    now_year = 2019 - now_delta_years\n    max_year = 2024\n\n    min_y = 0\n    max_y = None\n    color = graph_type\n    if "bronze" in graph_type:\n        color = "bronze"\n                        \n    if isinstance(data_type, pd.DataFrame):\n        df_this_color = data_type.loc[(data_type.graph_type==graph_type)]\n    elif data_type == "basic":\n        df_this_color = articles_by_color_by_year.loc[(articles_by_color_by_year.oa_status==color)]\n    else:\n        df_this_color = articles_by_graph_type_by_year.loc[(unpaywall_graph_type.oa_status==graph_type)]\n\n    totals = pd.DataFrame()\n    for i, prediction_year in enumerate(range(calc_min_year, now_year)):\n\n        if "published_year" in df_this_color.columns:\n            if cumulative:\n                df_this_plot = df_this_color.loc[(df_this_color["published_year"] <= prediction_year)]\n            else:\n                df_this_plot = df_this_color.loc[(df_this_color["published_year"] == prediction_year)]\n        else:\n            df_this_plot = df_this_color\n        y = [a for a in df_this_plot["num_articles"] if not np.isnan(a)]\n        prediction_y = sum(y)\n\n        totals = totals.append(pd.DataFrame(data={"prediction_year": [prediction_year], \n                                             "num_articles": [prediction_y]}))\n\n      \n    x = totals["prediction_year"]\n    y = totals["num_articles"]\n    xnew = np.arange(now_year-1, max_year+1, 1)\n    if extrap=="linear":\n        f = scipy.interpolate.interp1d(x, y, fill_value="extrapolate", kind="linear")\n        ynew = f(xnew)\n    else:\n        f = scipy.interpolate.interp1d(x, np.log10(y), fill_value="extrapolate", kind="linear")\n        ynew = 10 ** f(xnew)\n    \n    new_data = pd.DataFrame({"color":color, "graph_type": graph_type, "x":np.append(x[:-1], xnew), "y":np.append(y[:-1], ynew)})\n\n    return new_data\n\n\ndef graph_data_extrapolated(graph_type, data_type=False, extrap="linear", now_delta_years=0, ax=None, cumulative=True):\n    calc_min_year = 1951\n    display_min_year = 2000\n    now_year = 2019 - now_delta_years\n    max_year = 2024\n\n    min_y = 0\n    max_y = None\n    color = graph_type\n    if "bronze" in graph_type:\n        color = "bronze"\n    \n    new_data = get_data_extrapolated(graph_type, data_type, extrap, now_delta_years, cumulative)\n\n    year_range = range(display_min_year, now_year)\n    \n    if not isinstance(data_type, pd.DataFrame) and data_type == "simple":\n        my_color_lookup = oa_color_lookup.loc[oa_color_lookup["name"]==color]\n    else:\n        my_color_lookup = graph_type_lookup.loc[graph_type_lookup["name"]==graph_type]\n    \n    if not ax:\n        fig = plt.figure()\n        ax = plt.subplot(111)\n\n    if not max_y:\n        max_y = 5 * max(new_data["y"])\n\n    df_actual = new_data.loc[new_data["x"] < now_year]\n    x = [int(a) for a in df_actual["x"]]\n    y = [int(a) for a in df_actual["y"]]\n    df_future = new_data.loc[new_data["x"] >= now_year]\n    xnew = [int(a) for a in df_future["x"]]\n    ynew = [int(a) for a in df_future["y"]]\n\n    ax.plot(x, y, \'o\', color="black")\n    ax.fill_between(x, y, color=my_color_lookup["color"])\n\n    ax.plot(xnew, ynew, \'o\', color="black", alpha=0.3)\n    ax.fill_between(xnew, ynew, color=my_color_lookup["color"], alpha=0.3)\n    if cumulative:\n        ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: \'{0:,.0f}\'.format(y/(1000*1000.0))))\n        ax.set_ylabel("articles (millions)")\n        ax.set_xlabel("year")\n    else:\n        ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: \'{0:,.1f}\'.format(y/(1000*1000.0))))\n        ax.set_ylabel("articles (millions)")\n        ax.set_xlabel("year of publication")\n    ax.set_xlim(min(year_range), max_year)\n    ax.set_title(graph_type);\n\n    return new_data')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\ndef get_data_extrapolated(graph_type, data_type=False, extrap="linear", now_delta_years=0, cumulative=True):\n    \n    calc_min_year = 1951\n    display_min_year = 2010\n    now_year = 2019 - now_delta_years\n    max_year = 2024\n\n    min_y = 0\n    max_y = None\n    color = graph_type\n    if "bronze" in graph_type:\n        color = "bronze"\n                        \n    if isinstance(data_type, pd.DataFrame):\n        df_this_color = data_type.loc[(data_type.graph_type==graph_type)]\n    elif data_type == "basic":\n        articles_by_color_by_year = get_dataset("articles_by_color_by_year")\n        df_this_color = articles_by_color_by_year.loc[(articles_by_color_by_year.oa_status==color)]\n    else:\n        articles_by_graph_type_by_year = get_dataset("articles_by_graph_type_by_year")\n        df_this_color = articles_by_graph_type_by_year.loc[(unpaywall_graph_type.oa_status==graph_type)]\n\n    totals = FrameBuilder()\n    for i, prediction_year in enumerate(range(calc_min_year, now_year)):\n\n        if "published_year" in df_this_color.columns:\n            if cumulative:\n                df_this_plot = df_this_color.loc[(df_this_color["published_year"] <= prediction_year)]\n            else:\n                df_this_plot = df_this_color.loc[(df_this_color["published_year"] == prediction_year)]\n        else:\n            df_this_plot = df_this_color\n        y = [a for a in df_this_plot["num_articles"] if not np.isnan(a)]\n        prediction_y = sum(y)\n\n        totals.add(prediction_year=prediction_year, num_articles=prediction_y)\n\n    totals = totals.build()\n    x = totals["prediction_year"]\n    y = totals["num_articles"]\n    xnew = np.arange(now_year-1, max_year+1, 1)\n    if extrap=="linear":\n        f = scipy.interpolate.interp1d(x, y, fill_value="extrapolate", kind="linear")\n        ynew = f(xnew)\n    else:\n        f = scipy.interpolate.interp1d(x, np.log10(y), fill_value="extrapolate", kind="linear")\n        ynew = 10 ** f(xnew)\n    \n    new_data = pd.DataFrame({"color":color, "graph_type": graph_type, "x":np.append(x[:-1], xnew), "y":np.append(y[:-1], ynew)})\n\n    return new_data\n\n\ndef graph_data_extrapolated(graph_type, data_type=False, extrap="linear", now_delta_years=0, ax=None, cumulative=True):\n    calc_min_year = 1951\n    display_min_year = 2000\n    now_year = 2019 - now_delta_years\n    max_year = 2024\n\n    min_y = 0\n    max_y = None\n    color = graph_type\n    if "bronze" in graph_type:\n        color = "bronze"\n    \n    new_data = get_data_extrapolated(graph_type, data_type, extrap, now_delta_years, cumulative)\n\n    year_range = range(display_min_year, now_year)\n    \n    if not isinstance(data_type, pd.DataFrame) and data_type == "simple":\n        my_color_lookup = oa_color_lookup.loc[oa_color_lookup["name"]==color]\n    else:\n        my_color_lookup = graph_type_lookup.loc[graph_type_lookup["name"]==graph_type]\n    \n    if not ax:\n        fig = plt.figure()\n        ax = plt.subplot(111)\n\n    if not max_y:\n        max_y = 5 * max(new_data["y"])\n\n    df_actual = new_data.loc[new_data["x"] < now_year]\n    x = [int(a) for a in df_actual["x"]]\n    y = [int(a) for a in df_actual["y"]]\n    df_future = new_data.loc[new_data["x"] >= now_year]\n    xnew = [int(a) for a in df_future["x"]]\n    ynew = [int(a) for a in df_future["y"]]\n\n    ax.plot(x, y, \'o\', color="black")\n    ax.fill_between(x, y, color=my_color_lookup["color"])\n\n    ax.plot(xnew, ynew, \'o\', color="black", alpha=0.3)\n    ax.fill_between(xnew, ynew, color=my_color_lookup["color"], alpha=0.3)\n    if cumulative:\n        ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: \'{0:,.0f}\'.format(y/(1000*1000.0))))\n        ax.set_ylabel("articles (millions)")\n        ax.set_xlabel("year")\n    else:\n        ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: \'{0:,.1f}\'.format(y/(1000*1000.0))))\n        ax.set_ylabel("articles (millions)")\n        ax.set_xlabel("year of publication")\n    ax.set_xlim(min(year_range), max_year)\n    ax.set_title(graph_type);\n\n    return new_data')
 
 
 # In[5]:
@@ -219,39 +939,104 @@ get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display'
 # In[7]:
 
 
+# the extrapolated curves in final_extraps as one (graph_type, x) -> y lookup,
+# made again whenever final_extraps is replaced
+extrap_scale_index = None
+extrap_scale_index_source = None
+
+def get_extrap_scale_index():
+    global extrap_scale_index, extrap_scale_index_source
+    if extrap_scale_index_source is not final_extraps:
+        extrap_scale_index = final_extraps.set_index(["graph_type", "x"])["y"]
+        extrap_scale_index_source = final_extraps
+    return extrap_scale_index
+
+# the extrapolated curve of graph_type at years.  final_extraps stops at
+# extrap_max_year, and later years come from the final fit
+# (get_final_curve_fit), as long as that's the curve final_extraps has
+def get_extrap_curve(graph_type, years):
+    years = np.asarray(years)
+    curve = get_extrap_scale_index().loc[graph_type]
+    last_year = curve.index.max()
+    later = years > last_year
+    values = np.zeros(len(years))
+    values[~later] = curve.loc[years[~later]].values
+    if later.any():
+        fit = get_final_curve_fit(graph_type) if graph_type in final_curve_types else None
+        if fit is None or not np.isclose(evaluate_curve(graph_type, final_curve_types[graph_type], fit["pars"], last_year), curve.loc[last_year]):
+            raise ValueError("the {} curve in final_extraps stops at {} and isn't its final fit, so it can't be extended to {}.  "
+                             "set FUTURE_OA_END_YEAR to at least {} before the curves are fit".format(graph_type, last_year, years.max(), years.max()))
+        values[later] = evaluate_curve(graph_type, final_curve_types[graph_type], fit["pars"], years[later])
+    return values
+
+# each future year, last year's papers are a year older, and the papers new
+# last year come again, scaled by how much the curve has grown since now_year.
+# after k years, a row that was age d in now_year is age d+k with
+#     all[d] + sum over j=1..k of int(scale[j] * new[d+j])
+# so every year is a cumulative sum down the diagonals of one array
+def project_papers_by_availability_year(graph_type, current_year_all, now_year_new, now_year, end_year):
+    prediction_years = np.arange(now_year + 1, end_year + 1)
+    scales = get_extrap_curve(graph_type, prediction_years)
+    scales /= int(get_extrap_curve(graph_type, [now_year])[0])
+
+    (num_articles, present, ages) = project_num_articles(scales, current_year_all, now_year_new)
+    year_indexes, age_indexes = np.nonzero(present)
+    my_return = pd.DataFrame({
+        "num_articles": num_articles[present],
+        "article_years_from_availability": ages[present],
+        "prediction_year": prediction_years[year_indexes]
+    }, index=(np.cumsum(present, axis=1) - 1)[present])
+    return my_return
+
+# the arrays behind that: num_articles by [year, age in now_year], which ages
+# have a row, and how old they are in each year.  scales can have more
+# dimensions in front of the years, like [draw, year], and num_articles gets
+# them too
+def project_num_articles(scales, current_year_all, now_year_new):
+    all_ages = current_year_all["article_years_from_availability"].values.astype(int)
+    new_ages = now_year_new["article_years_from_availability"].values.astype(int)
+    num_years = scales.shape[-1]
+    min_age = np.append(all_ages, new_ages).min(initial=0) - num_years
+    max_age = np.append(all_ages, new_ages).max(initial=0) + num_years
+    all_counts = np.zeros(max_age - min_age + 1)
+    all_present = np.zeros(max_age - min_age + 1, dtype=bool)
+    new_counts = np.zeros(max_age - min_age + 1)
+    new_present = np.zeros(max_age - min_age + 1, dtype=bool)
+    all_counts[all_ages - min_age] = np.nan_to_num(current_year_all["num_articles"].values.astype(float))
+    all_present[all_ages - min_age] = True
+    new_counts[new_ages - min_age] = np.nan_to_num(now_year_new["num_articles"].values.astype(float))
+    new_present[new_ages - min_age] = True
+
+    # [year, age in now_year]
+    starting_ages = np.arange(min_age, max_age - num_years + 1)
+    steps = np.arange(1, num_years + 1)[:, None]
+    diagonals = np.arange(len(starting_ages))[None, :] + steps
+    num_articles = all_counts[:len(starting_ages)] + np.cumsum(np.trunc(scales[..., :, None] * new_counts[diagonals]), axis=-2)
+    present = all_present[None, :len(starting_ages)] | np.logical_or.accumulate(new_present[diagonals], axis=0)
+    ages = starting_ages[None, :] + steps
+    return (num_articles, present, ages)
+
 def get_papers_by_availability_year_including_future(graph_type, start_year, end_year):
     start_calc_year = 2009
     last_year_before_extrap = 2017
     offset = 0
     global final_extraps
     
-    my_return = pd.DataFrame()
+    my_return = FrameBuilder()
 
     for prediction_year in range(min(start_year, start_calc_year), last_year_before_extrap+1):        
 #         print prediction_year
         papers_per_year = get_papers_by_availability_year(graph_type, prediction_year, just_this_year=False)
         papers_per_year["prediction_year"] = prediction_year
-        my_return = my_return.append(papers_per_year)
+        my_return.add(papers_per_year)
         
-    if end_year >= last_year_before_extrap:
-        scale_df = final_extraps.copy()
+    if end_year > last_year_before_extrap:
         current_year_all = get_papers_by_availability_year(graph_type, last_year_before_extrap, just_this_year=False)
         now_year_new = get_papers_by_availability_year(graph_type, last_year_before_extrap, just_this_year=True)
-        for i, prediction_year in enumerate(range(last_year_before_extrap+1, end_year+1)): 
-            current_year_all["article_years_from_availability"] += 1 
-#             print now_year_all.head()
-#             print now_year_new.head()
-            merged_df = current_year_all.merge(now_year_new, on="article_years_from_availability", suffixes=["_all", "_new"], how="outer")
-            merged_df = merged_df.fillna(0)
-#             print merged_df.head(10)
-            scale = float(scale_df.loc[(scale_df.x==prediction_year)&(scale_df.graph_type==graph_type)].y) / int(scale_df.loc[(scale_df.x==last_year_before_extrap)&(scale_df.graph_type==graph_type)].y) 
-            merged_df["num_articles"] = merged_df["num_articles_all"] + [int(scale * a) for a in merged_df["num_articles_new"]]
-            merged_df["prediction_year"] = prediction_year
-            current_year_all = pd.DataFrame(merged_df, columns=["num_articles", 
-                                                      "article_years_from_availability", 
-                                                      "prediction_year"])
-            my_return = my_return.append(current_year_all)
+        future_years = project_papers_by_availability_year(graph_type, current_year_all, now_year_new, last_year_before_extrap, end_year)
+        my_return.add(future_years)
 
+    my_return = my_return.build()
     my_return.reset_index(inplace=True)
     return my_return
 
@@ -259,7 +1044,7 @@ def get_papers_by_availability_year_including_future(graph_type, start_year, end
 # In[8]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# graph!  :)\n\ndef graph_views(graph_type, data=None, now_delta_years=0, ax=None):\n    calc_min_year = 1951\n    display_min_year = 2010\n    now_year = 2018 - now_delta_years\n    max_year = 2025\n\n    color = graph_type\n\n    if isinstance(data, pd.DataFrame):\n        df_views_by_year = data\n    else:\n        df_views_by_year = get_predicted_views(graph_type, display_min_year, max_year)\n\n    year_range = range(display_min_year, now_year)\n    if graph_type == "biorxiv":\n        my_color_lookup = {"color": "limegreen"}\n    else:\n        my_color_lookup = graph_type_lookup.loc[graph_type_lookup["name"]==color]\n        \n    if not ax:\n        fig = plt.figure()\n        ax = plt.subplot(111)\n\n    \n    x = [int(a) for a in df_views_by_year["observation_year"]]\n    y = [int(a) for a in df_views_by_year["views"]]\n    max_y = 1.2 * max(y)\n\n    ax.scatter(x, y, marker=\'x\', s=70, color=my_color_lookup["color"])\n\n    ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: \'{0:,.1f}\'.format(y/(1000*1000.0))))\n    ax.set_ylabel("views (millions)")\n\n    ax.set_xlim(min(year_range), max_year+1)\n#         ax.set_ylim(0, max_y)\n    ax.set_xlabel(\'view year\')\n#     title = plt.suptitle("Estimated views by access year, by OA type")\n#     title.set_position([.5, 1.05])\n    return df_views_by_year')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# graph!  :)\n\ndef graph_views(graph_type, data=None, now_delta_years=0, ax=None):\n    calc_min_year = 1951\n    display_min_year = 2010\n    now_year = 2018 - now_delta_years\n    max_year = 2025\n\n    color = graph_type\n\n    if isinstance(data, pd.DataFrame):\n        df_views_by_year = data\n    else:\n        df_views_by_year = get_predicted_views(graph_type)\n\n    year_range = range(display_min_year, now_year)\n    if graph_type == "biorxiv":\n        my_color_lookup = {"color": "limegreen"}\n    else:\n        my_color_lookup = graph_type_lookup.loc[graph_type_lookup["name"]==color]\n        \n    if not ax:\n        fig = plt.figure()\n        ax = plt.subplot(111)\n\n    \n    x = [int(a) for a in df_views_by_year["observation_year"]]\n    y = [int(a) for a in df_views_by_year["views"]]\n    max_y = 1.2 * max(y)\n\n    ax.scatter(x, y, marker=\'x\', s=70, color=my_color_lookup["color"])\n\n    ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: \'{0:,.1f}\'.format(y/(1000*1000.0))))\n    ax.set_ylabel("views (millions)")\n\n    ax.set_xlim(min(year_range), max_year+1)\n#         ax.set_ylim(0, max_y)\n    ax.set_xlabel(\'view year\')\n#     title = plt.suptitle("Estimated views by access year, by OA type")\n#     title.set_position([.5, 1.05])\n    return df_views_by_year')
 
 
 # In[9]:
@@ -268,11 +1053,206 @@ get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display'
 
 # do calculations
 
+# get_papers_by_availability_year is called thousands of times, so rather than
+# filter and pivot the datasets on every call, everything it can return is
+# worked out once into the cohort tensor: num_articles by [graph_type,
+# availability_year, article_years_from_availability], for just_this_year
+# False ("all") and True ("this_year"), with a mask of which ages have a row.
+# a call is then a slice of it.  calls it doesn't cover (other graph types or
+# years) go to compute_papers_by_availability_year, which is how it used to be
+# done, and is what the tensor has to match.
+cohort_graph_types = ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed", "biorxiv"]
+cohort_open_graph_types = ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze"]
+cohort_max_year = 2050
+closed_min_year = 1990
+cohort_tensor = None
+
+def get_cohort_tensor():
+    global cohort_tensor
+    with get_thread_lock("memo/cohort_tensor"):
+        if cohort_tensor is None:
+            cohort_tensor = build_cohort_tensor()
+        return cohort_tensor
+
+# num_articles by published year, as [availability year, age] arrays: an article
+# published in year p is age y - p in year y, once it's published
+def spread_by_published_year(counts_by_year, years, ages):
+    published_years = years[:, None] - ages[None, :]
+    counts = counts_by_year.astype(float).reindex(published_years.ravel()).values.reshape(published_years.shape)
+    present = ~np.isnan(counts) & (published_years <= years[:, None])
+    return np.where(present, counts, 0), present
+
+def build_cohort_tensor():
+    articles_by_color_by_year = get_dataset("articles_by_color_by_year")
+    articles_by_color_by_year_with_embargos = get_dataset("articles_by_color_by_year_with_embargos")
+    delayed_bronze = get_dataset("delayed_bronze_after_embargos_age_years")
+    biorxiv = get_dataset("biorxiv_growth_otherwise_closed")
+    biorxiv = pd.DataFrame({"published_year": biorxiv["published_year"].astype(float).astype(int),
+                            "num_articles": biorxiv["num_articles"].astype(float)})
+    green = get_dataset("green_oa_with_dates_by_availability")
+    green = green.loc[(green["months_old_at_first_deposit"] >= -24) & (green["months_old_at_first_deposit"] <= 12*25)]
+    green = green.loc[green["published_year"].notnull() & green["year_of_first_availability"].notnull()]
+    green = green.groupby([green["year_of_first_availability"].astype(int), green["published_year"].astype(int)])["num_articles"].sum()
+    green = green.unstack()
+
+    # the years and ages every dataset fits in
+    published_years = np.concatenate([articles_by_color_by_year["published_year"].values.astype(int),
+                                      biorxiv["published_year"].values, green.columns.values])
+    first_year = min(closed_min_year, published_years.min(), green.index.min(), delayed_bronze["prediction_year"].min()) - 1
+    years = np.arange(first_year, cohort_max_year + 1)
+    min_age = min(0, (green.index.values[:, None] - green.columns.values[None, :])[green.notnull().values].min())
+    max_age = max(cohort_max_year - published_years.min(), delayed_bronze["article_age_years"].max(), cohort_max_year - closed_min_year)
+    ages = np.arange(min_age, max_age + 1)
+
+    shape = (len(cohort_graph_types), len(years), len(ages))
+    num_articles = np.zeros(shape)
+    present = np.zeros(shape, dtype=bool)
+    def set_graph_type(graph_type, counts_and_present):
+        i = cohort_graph_types.index(graph_type)
+        num_articles[i], present[i] = counts_and_present
+
+    for graph_type in ["gold", "hybrid"]:
+        counts_by_year = articles_by_color_by_year.loc[articles_by_color_by_year.oa_status == graph_type]
+        counts_by_year = counts_by_year.set_index(counts_by_year["published_year"].astype(int))["num_articles"]
+        set_graph_type(graph_type, spread_by_published_year(counts_by_year, years, ages))
+
+    immediate_bronze = articles_by_color_by_year_with_embargos.loc[(articles_by_color_by_year_with_embargos.oa_status=="bronze") &
+                                                                  (articles_by_color_by_year_with_embargos["embargo"].isnull())]
+    counts_by_year = immediate_bronze.groupby(immediate_bronze["published_year"].astype(int))["num_articles"].sum()
+    set_graph_type("immediate_bronze", spread_by_published_year(counts_by_year, years, ages))
+
+    set_graph_type("biorxiv", spread_by_published_year(biorxiv.set_index("published_year")["num_articles"], years, ages))
+
+    # green counts everything deposited by the availability year, so add up
+    # the first availability years as we go.  green can be deposited before
+    # it's published, so it has negative ages too
+    green_counts = np.nancumsum(green.values, axis=0)
+    green_present = np.cumsum(green.notnull().values, axis=0) > 0
+    rows_by_year = np.searchsorted(green.index.values, years, side="right") - 1
+    green_by_year = np.where(green_present[rows_by_year], green_counts[rows_by_year], np.nan)
+    green_by_year[rows_by_year < 0] = np.nan
+    published_years = years[:, None] - ages[None, :]
+    columns = np.clip(np.searchsorted(green.columns.values, published_years), 0, len(green.columns) - 1)
+    counts = np.where(green.columns.values[columns] == published_years,
+                      green_by_year[np.arange(len(years))[:, None], columns], np.nan)
+    set_graph_type("green", (np.nan_to_num(counts), ~np.isnan(counts)))
+
+    i = cohort_graph_types.index("delayed_bronze")
+    delayed_bronze = delayed_bronze.loc[(delayed_bronze["prediction_year"] >= years[0]) & (delayed_bronze["prediction_year"] <= years[-1])]
+    year_indexes = delayed_bronze["prediction_year"].values.astype(int) - years[0]
+    age_indexes = delayed_bronze["article_age_years"].values.astype(int) - ages[0]
+    num_articles[i, year_indexes, age_indexes] = delayed_bronze["num_articles"].values
+    present[i, year_indexes, age_indexes] = True
+
+    # closed is everything published that year that isn't open at age 0 ...
+    age_0 = -ages[0]
+    total_by_year = articles_by_color_by_year.groupby(articles_by_color_by_year["published_year"].astype(int))["num_articles"].sum()
+    total_by_year = total_by_year.reindex(years, fill_value=0).values.astype(float)
+    open_indexes = [cohort_graph_types.index(graph_type) for graph_type in cohort_open_graph_types]
+    closed_by_year = total_by_year - num_articles[open_indexes, :, age_0].sum(axis=0)
+    # ... and by availability year, the closed papers of each year since 1990,
+    # all availability years and ages at once
+    closed_index = cohort_graph_types.index("closed")
+    published_years = years[:, None] - ages[None, :]
+    closed_present = (ages >= 0)[None, :] & (published_years >= closed_min_year)
+    published_indexes = np.clip(published_years - years[0], 0, len(years) - 1)
+    num_articles[closed_index] = np.where(closed_present, closed_by_year[published_indexes], 0)
+    present[closed_index] = closed_present
+
+    # just this year: what's new since the year before, the same ages a year
+    # younger then.  closed is just its own age 0
+    num_articles_this_year = num_articles.copy()
+    num_articles_this_year[:, 1:, 1:] -= np.where(present[:, :-1, :-1], num_articles[:, :-1, :-1], 0)
+    num_articles_this_year[num_articles_this_year < 25] = 0
+    present_this_year = present & (ages <= 10)[None, None, :]
+    num_articles_this_year[closed_index] = 0
+    num_articles_this_year[closed_index, :, age_0] = closed_by_year
+    present_this_year[closed_index] = False
+    present_this_year[closed_index, :, age_0] = True
+
+    # counts come back as whole numbers unless they were scaled from a sample
+    if not sample_fraction:
+        num_articles = num_articles.astype(int)
+        num_articles_this_year = num_articles_this_year.astype(int)
+
+    return {
+        "graph_types": cohort_graph_types,
+        "years": years,
+        "ages": ages,
+        "num_articles_all": num_articles,
+        "present_all": present,
+        "num_articles_this_year": num_articles_this_year,
+        "present_this_year": present_this_year
+    }
+
+# the same calls come again and again (closed asks for every year back to 1990,
+# each of those for all five open types, just_this_year for the year before
+# too), so answers are also kept, up to cohort_cache_max_size of them, least
+# recently used out first.  callers get a view of the kept answer, so
+# changing it doesn't change what the next caller gets.
+cohort_cache = collections.OrderedDict()
+cohort_cache_max_size = 10000
+cohort_cache_stats = collections.Counter()
+# pipeline nodes can be computed on several threads at once.  the lock is only
+# held to read or change the cache, not while an answer is worked out, since
+# working one out can call back in here for other years
+cohort_cache_lock = threading.Lock()
+
 def get_papers_by_availability_year(graph_type="closed", availability_year=2000, just_this_year=False):
+    key = (graph_type, availability_year, bool(just_this_year))
+    with cohort_cache_lock:
+        my_return = cohort_cache.get(key)
+        if my_return is not None:
+            cohort_cache_stats["hits"] += 1
+            cohort_cache.move_to_end(key)
+            return my_return.copy(deep=False)
+        cohort_cache_stats["misses"] += 1
+
+    my_return = lookup_papers_by_availability_year(*key)
+    with cohort_cache_lock:
+        cohort_cache[key] = my_return
+        if len(cohort_cache) > cohort_cache_max_size:
+            cohort_cache.popitem(last=False)
+            cohort_cache_stats["evictions"] += 1
+    return my_return.copy(deep=False)
+
+def cohort_cache_info():
+    return {
+        "hits": cohort_cache_stats["hits"],
+        "misses": cohort_cache_stats["misses"],
+        "evictions": cohort_cache_stats["evictions"],
+        "size": len(cohort_cache),
+        "max_size": cohort_cache_max_size
+    }
+
+# when the datasets change, the tensor and the kept answers are out of date
+def invalidate_cohorts():
+    global cohort_tensor
+    cohort_tensor = None
+    cohort_cache.clear()
+
+dataset_change_hooks.append(invalidate_cohorts)
+
+def lookup_papers_by_availability_year(graph_type="closed", availability_year=2000, just_this_year=False):
+    cohorts = get_cohort_tensor()
+    if graph_type not in cohorts["graph_types"] or not (cohorts["years"][0] < availability_year <= cohorts["years"][-1]):
+        return compute_papers_by_availability_year(graph_type, availability_year, just_this_year)
+
+    key = "this_year" if just_this_year else "all"
+    i = cohorts["graph_types"].index(graph_type)
+    year_index = availability_year - cohorts["years"][0]
+    present = cohorts["present_" + key][i, year_index]
+    return pd.DataFrame({
+        "article_years_from_availability": cohorts["ages"][present],
+        "num_articles": cohorts["num_articles_" + key][i, year_index][present]
+    })
+
+def compute_papers_by_availability_year(graph_type="closed", availability_year=2000, just_this_year=False):
     my_return = pd.DataFrame()
         
     if just_this_year:
         if graph_type == "closed":
+            articles_by_color_by_year = get_dataset("articles_by_color_by_year")
             rows_published_this_year = articles_by_color_by_year.loc[articles_by_color_by_year["published_year"] == availability_year]
             total_this_year = rows_published_this_year.num_articles.sum()
             
@@ -296,7 +1276,7 @@ def get_papers_by_availability_year(graph_type="closed", availability_year=2000,
             df_merged = this_year_history.merge(prev_year_history, on="article_years_from_availability", how="left")
             df_merged = df_merged.fillna(0)
             df_merged["num_articles"] = df_merged["num_articles_x"] - df_merged["num_articles_y"]
-            df_merged["num_articles"][df_merged["num_articles"] < 25] = 0
+            df_merged.loc[df_merged["num_articles"] < 25, "num_articles"] = 0
             df_merged = df_merged.loc[df_merged["article_years_from_availability"] <= 10]
             my_return = pd.DataFrame({
                 "article_years_from_availability": df_merged["article_years_from_availability"],
@@ -306,6 +1286,7 @@ def get_papers_by_availability_year(graph_type="closed", availability_year=2000,
     else:
             
         if graph_type == "delayed_bronze":
+            delayed_bronze_after_embargos_age_years = get_dataset("delayed_bronze_after_embargos_age_years")
             temp_papers = delayed_bronze_after_embargos_age_years.loc[delayed_bronze_after_embargos_age_years["prediction_year"]==availability_year]
             my_return = pd.DataFrame({
                 "article_years_from_availability": temp_papers["article_age_years"],
@@ -314,7 +1295,7 @@ def get_papers_by_availability_year(graph_type="closed", availability_year=2000,
 
         elif graph_type == "green":
 
-            my_green_oa = green_oa_with_dates_by_availability
+            my_green_oa = get_dataset("green_oa_with_dates_by_availability")
 
             my_green_oa = my_green_oa.loc[my_green_oa["months_old_at_first_deposit"] >= -24]
             my_green_oa = my_green_oa.loc[my_green_oa["months_old_at_first_deposit"] <= 12*25]
@@ -331,13 +1312,15 @@ def get_papers_by_availability_year(graph_type="closed", availability_year=2000,
             })
 
         elif graph_type == "closed":
-            my_return = pd.DataFrame()
+            my_return = FrameBuilder()
             for i, year in enumerate(range(availability_year+1, 1990, -1)):
                 closed_rows = get_papers_by_availability_year(graph_type, availability_year - i, just_this_year=True)
                 closed_rows["article_years_from_availability"] = i
-                my_return = my_return.append(closed_rows)
+                my_return.add(closed_rows)
+            my_return = my_return.build()
             
         elif graph_type == "immediate_bronze":
+            articles_by_color_by_year_with_embargos = get_dataset("articles_by_color_by_year_with_embargos")
             temp_papers = articles_by_color_by_year_with_embargos.loc[(articles_by_color_by_year_with_embargos.oa_status=="bronze") &
                                                                    (articles_by_color_by_year_with_embargos["embargo"].isnull()) &
                                                                   (articles_by_color_by_year_with_embargos.published_year <= availability_year)]
@@ -351,10 +1334,11 @@ def get_papers_by_availability_year(graph_type="closed", availability_year=2000,
             })
 
         elif graph_type == "biorxiv": 
-            my_return = biorxiv_growth_otherwise_closed.copy()
+            my_return = get_dataset("biorxiv_growth_otherwise_closed")
             my_return = my_return.loc[my_return["published_year"] <= availability_year]
             my_return["article_years_from_availability"] = availability_year - my_return["published_year"]
         else:
+            articles_by_color_by_year = get_dataset("articles_by_color_by_year")
             temp_papers = articles_by_color_by_year.loc[(articles_by_color_by_year.oa_status==graph_type) &
                                                     (articles_by_color_by_year.published_year <= availability_year)]
             my_return = pd.DataFrame({
@@ -375,7 +1359,7 @@ def get_papers_by_availability_year(graph_type="closed", availability_year=2000,
 # In[10]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\ndef get_predicted_views_by_pubdate(graph_type, observation_year):\n\n    views_per_article = get_views_per_article(graph_type)\n           \n    df_views_by_year = pd.DataFrame()\n    all_papers_per_year = get_papers_by_availability_year_including_future(graph_type, observation_year, observation_year+1)\n    papers_per_year = all_papers_per_year.loc[all_papers_per_year["prediction_year"] == observation_year]\n    \n    try:\n        data_merged_clean = papers_per_year.merge(views_per_article, left_on=["article_years_from_availability"], right_on=["article_age_years"])\n        data_merged_clean = data_merged_clean.sort_values("article_age_years")\n#         print data_merged_clean.head()\n        data_merged_clean["views"] = data_merged_clean["views_per_article"] * data_merged_clean["num_articles"]\n        data_merged_clean["observation_year"] = observation_year\n        data_merged_clean["publication_year"] = observation_year - data_merged_clean["article_age_years"]\n        new_data = pd.DataFrame(data_merged_clean, columns=["publication_year", "views", "article_age_years", "observation_year"])\n        df_views_by_year = df_views_by_year.append(new_data)\n    except (ValueError, KeyError):  # happens when the year is blank\n        pass\n    \n    return df_views_by_year')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\ndef get_predicted_views_by_pubdate(graph_type, observation_year):\n\n    views_per_article = get_views_per_article(graph_type)\n           \n    df_views_by_year = pd.DataFrame()\n    all_papers_per_year = get_papers_by_availability_year_including_future(graph_type, observation_year, observation_year+1)\n    papers_per_year = all_papers_per_year.loc[all_papers_per_year["prediction_year"] == observation_year]\n    \n    try:\n        data_merged_clean = papers_per_year.merge(views_per_article, left_on=["article_years_from_availability"], right_on=["article_age_years"])\n        data_merged_clean = data_merged_clean.sort_values("article_age_years")\n#         print data_merged_clean.head()\n        data_merged_clean["views"] = data_merged_clean["views_per_article"] * data_merged_clean["num_articles"]\n        data_merged_clean["observation_year"] = observation_year\n        data_merged_clean["publication_year"] = observation_year - data_merged_clean["article_age_years"]\n        new_data = pd.DataFrame(data_merged_clean, columns=["publication_year", "views", "article_age_years", "observation_year"])\n        df_views_by_year = new_data\n    except (ValueError, KeyError):  # happens when the year is blank\n        pass\n    \n    return df_views_by_year')
 
 
 # In[ ]:
@@ -387,19 +1371,20 @@ get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display'
 # In[11]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\ndef get_predicted_views(graph_type, now_delta_years=0):\n#     calc_min_year = 1951\n    calc_min_year = 1995\n    display_min_year = 2010\n    now_year = 2020 - now_delta_years\n    max_year = 2024\n    exponential = False\n\n    if graph_type == "biorxiv":\n        exponential = True\n        \n    views_per_article = get_views_per_article(graph_type)\n           \n    df_views_by_year = pd.DataFrame()\n    \n    all_papers_per_year = all_predicted_papers_future\n    for prediction_year in range(calc_min_year, max_year+1):        \n#     for prediction_year in range(calc_min_year, 2019):        \n#     for prediction_year in range(2017, 2019):        \n        papers_per_year = all_papers_per_year.loc[all_papers_per_year["prediction_year"] == prediction_year]\n        papers_per_year = papers_per_year.loc[papers_per_year["graph_type"] == graph_type]\n#         print views_per_article.head()\n        try:\n            data_merged_clean = papers_per_year.merge(views_per_article, left_on=["article_years_from_availability"], right_on=["article_age_years"])\n            data_merged_clean = data_merged_clean.sort_values("article_age_years")\n            win = data_merged_clean["views_per_article"] \n            sig = data_merged_clean["num_articles"]\n            views_by_access_year = signal.convolve(win, sig, mode=\'same\', method="direct")\n            y = max(views_by_access_year)\n            df_views_by_year = df_views_by_year.append(pd.DataFrame({"observation_year":[prediction_year], "views": [y]}))\n        except (ValueError, KeyError):  # happens when the year is blank\n            pass\n        \n\n    return df_views_by_year')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\ndef get_predicted_views(graph_type):\n#     calc_min_year = 1951\n    calc_min_year = 1995\n    display_min_year = 2010\n    max_year = 2024\n    exponential = False\n\n    if graph_type == "biorxiv":\n        exponential = True\n        \n    views_per_article = get_views_per_article(graph_type)\n           \n    df_views_by_year = FrameBuilder()\n    \n    all_papers_per_year = all_predicted_papers_future\n    for prediction_year in range(calc_min_year, max_year+1):        \n#     for prediction_year in range(calc_min_year, 2019):        \n#     for prediction_year in range(2017, 2019):        \n        papers_per_year = all_papers_per_year.loc[all_papers_per_year["prediction_year"] == prediction_year]\n        papers_per_year = papers_per_year.loc[papers_per_year["graph_type"] == graph_type]\n#         print views_per_article.head()\n        try:\n            data_merged_clean = papers_per_year.merge(views_per_article, left_on=["article_years_from_availability"], right_on=["article_age_years"])\n            data_merged_clean = data_merged_clean.sort_values("article_age_years")\n            win = data_merged_clean["views_per_article"] \n            sig = data_merged_clean["num_articles"]\n            views_by_access_year = signal.convolve(win, sig, mode=\'same\', method="direct")\n            y = max(views_by_access_year)\n            df_views_by_year.add(observation_year=prediction_year, views=y)\n        except (ValueError, KeyError):  # happens when the year is blank\n            pass\n        \n\n    return df_views_by_year.build()')
 
 
 # In[12]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\ndef get_papers_by_availability_year_total(availability_year):\n    all_data = pd.DataFrame()\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n#     for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze"]:\n        temp_papers = get_papers_by_availability_year_including_future(prep_graph_type, availability_year, availability_year+1)\n        temp_papers["graph_type"] = prep_graph_type\n#         print prep_graph_type\n#         print "{:,.0f}".format(temp_papers.num_articles.max()), "{:,.0f}".format(temp_papers.num_articles.sum())\n#         print "\\n"\n        all_data = all_data.append(temp_papers)\n    return all_data\n\ndef get_views_per_year_total():\n    all_data = pd.DataFrame()\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n        temp_papers = get_views_per_year(prep_graph_type)\n        temp_papers["graph_type"] = prep_graph_type\n#         print prep_graph_type\n#         print "{:,.0f}".format(temp_papers.num_views_per_year.max()), "{:,.0f}".format(temp_papers.num_views_per_year.sum())\n#         print "\\n"\n        all_data = all_data.append(temp_papers)\n    return all_data\n\n\n\ndef get_views_per_article_total():\n    all_data = pd.DataFrame()\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n        temp_papers = get_views_per_article(prep_graph_type)\n#         print prep_graph_type\n#         print "{:,.0f}".format(temp_papers.views_per_article.max()), "{:,.0f}".format(temp_papers.views_per_article.sum())\n#         print "\\n"\n        temp_papers["graph_type"] = prep_graph_type\n        all_data = all_data.append(temp_papers)\n    return all_data\n\n\ndef get_predicted_views_total(observation_year):\n    all_data = pd.DataFrame()\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n#     for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze"]:\n        temp_papers = get_predicted_views(prep_graph_type, observation_year)\n        temp_papers["graph_type"] = prep_graph_type\n#         print prep_graph_type        \n        all_data = all_data.append(temp_papers)\n    return all_data\n\ndef get_predicted_views_by_pubdate_total(observation_year):\n    all_data = pd.DataFrame()\n#     for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze"]:\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n        temp_papers = get_predicted_views_by_pubdate(prep_graph_type, observation_year)\n        temp_papers["graph_type"] = prep_graph_type\n#         print prep_graph_type\n        all_data = all_data.append(temp_papers)\n    return all_data')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\ndef get_papers_by_availability_year_total(availability_year):\n    all_data = FrameBuilder()\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n#     for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze"]:\n        temp_papers = get_papers_by_availability_year_including_future(prep_graph_type, availability_year, availability_year+1)\n        temp_papers["graph_type"] = prep_graph_type\n#         print prep_graph_type\n#         print "{:,.0f}".format(temp_papers.num_articles.max()), "{:,.0f}".format(temp_papers.num_articles.sum())\n#         print "\\n"\n        all_data.add(temp_papers)\n    return all_data.build()\n\ndef get_views_per_year_total():\n    all_data = FrameBuilder()\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n        temp_papers = get_views_per_year(prep_graph_type)\n        temp_papers["graph_type"] = prep_graph_type\n#         print prep_graph_type\n#         print "{:,.0f}".format(temp_papers.num_views_per_year.max()), "{:,.0f}".format(temp_papers.num_views_per_year.sum())\n#         print "\\n"\n        all_data.add(temp_papers)\n    return all_data.build()\n\n\n\ndef get_views_per_article_total():\n    all_data = FrameBuilder()\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n        temp_papers = get_views_per_article(prep_graph_type)\n#         print prep_graph_type\n#         print "{:,.0f}".format(temp_papers.views_per_article.max()), "{:,.0f}".format(temp_papers.views_per_article.sum())\n#         print "\\n"\n        temp_papers["graph_type"] = prep_graph_type\n        all_data.add(temp_papers)\n    return all_data.build()\n\n\ndef get_predicted_views_total(observation_year):\n    all_data = FrameBuilder()\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n#     for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze"]:\n        temp_papers = get_predicted_views(prep_graph_type)\n        temp_papers = temp_papers.loc[temp_papers["observation_year"] <= observation_year]\n        temp_papers["graph_type"] = prep_graph_type\n#         print prep_graph_type        \n        all_data.add(temp_papers)\n    return all_data.build()\n\ndef get_predicted_views_by_pubdate_total(observation_year):\n    all_data = FrameBuilder()\n#     for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze"]:\n    for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:\n        temp_papers = get_predicted_views_by_pubdate(prep_graph_type, observation_year)\n        temp_papers["graph_type"] = prep_graph_type\n#         print prep_graph_type\n        all_data.add(temp_papers)\n    return all_data.build()')
 
 
 # In[13]:
 
 
 def get_views_per_year(graph_type):
+    views_by_age_years = get_dataset("views_by_age_years")
     if graph_type == "delayed_bronze":
         views_per_year = views_by_age_years.loc[(views_by_age_years.oa_status=="bronze") &
                                                        (views_by_age_years.delayed_or_immediate=="delayed")]
@@ -437,7 +1422,7 @@ def get_views_per_article(graph_type):
 
     if graph_type=="delayed_bronze":
         # otherwise first one is too high because number articles too low in year 0 for delayed subset
-        views_per_article.loc[views_per_article.article_age_years==0, ["views_per_article"]] = float(views_per_article.loc[views_per_article.article_age_years==1].views_per_article)
+        views_per_article.loc[views_per_article.article_age_years==0, ["views_per_article"]] = float(views_per_article.loc[views_per_article.article_age_years==1].views_per_article.iloc[0])
 
     return views_per_article
 
@@ -456,14 +1441,14 @@ get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display'
 def get_long_data(graph_type):
     full_range = range(1990, 2020)
 
-    totals_bronze = pd.DataFrame()
+    totals_bronze = FrameBuilder()
     for i, prediction_year in enumerate(full_range):
         new_frame = get_papers_by_availability_year(graph_type, prediction_year, just_this_year=True)
         new_frame["prediction_year"] = prediction_year
         new_frame["published_year"] = [int(prediction_year - a) for a in new_frame["article_years_from_availability"]]
-        totals_bronze = totals_bronze.append(new_frame)
+        totals_bronze.add(new_frame)
 
-    long_data_for_plot = totals_bronze
+    long_data_for_plot = totals_bronze.build()
     long_data_for_plot = long_data_for_plot.loc[long_data_for_plot["article_years_from_availability"] < 15]
     return long_data_for_plot
 
@@ -622,29 +1607,41 @@ def make_zoom_in_plot(graph_type):
 # In[18]:
 
 
-# Nonlinear curve fit with confidence interval
-def curve_fit_with_ci(graph_type, papers_per_year_historical, curve_type, ax=None):
+# the fitted curves are extrapolated through this year: 2050, or
+# FUTURE_OA_END_YEAR if that's set (never before 2040, which the figures use).
+# later years come from the final fits (see get_extrap_curve)
+extrap_max_year = max(int(os.getenv("FUTURE_OA_END_YEAR", "2050")), 2040)
+
+# fitting the growth curves.  get_fit_series makes the totals to fit for all
+# the graph types at once, fit_curves fits each curve type to each of them
+# (curve_fit, given the curves' derivatives), and evaluate_curve gives a fitted
+# curve at any years as an array.  none of it draws anything: curve_fit_with_ci
+# plots a fit, making it first if it isn't passed one.
+
+# the totals the growth curves are fit to: articles in their first five years
+# of availability, by year of observation, for observation years in
+# [fit_years[0], fit_years[1])
+def get_fit_data(papers_per_year_historical, fit_years=(2000, 2018)):
     my_rows = papers_per_year_historical.loc[papers_per_year_historical.article_years_from_availability <= 5]
-    my_rows = my_rows.loc[my_rows.prediction_year >= 2000]
-    my_rows = my_rows.loc[my_rows.prediction_year < 2018]
-    x = my_rows.groupby("prediction_year", as_index=False).sum().prediction_year
-    y = my_rows.groupby("prediction_year", as_index=False).sum().num_articles
+    my_rows = my_rows.loc[my_rows.prediction_year >= fit_years[0]]
+    my_rows = my_rows.loc[my_rows.prediction_year < fit_years[1]]
+    totals = my_rows.groupby("prediction_year", as_index=False)["num_articles"].sum()
+    return (totals.prediction_year, totals.num_articles)
+
+# the totals for every graph type at once, in one groupby: graph_type -> (x, y)
+# arrays, as get_fit_data would give for each of them
+def get_fit_series(papers_per_year_historical, fit_years=(2000, 2018)):
+    my_rows = papers_per_year_historical.loc[papers_per_year_historical.article_years_from_availability <= 5]
+    my_rows = my_rows.loc[(my_rows.prediction_year >= fit_years[0]) & (my_rows.prediction_year < fit_years[1])]
+    totals = my_rows.groupby(["graph_type", "prediction_year"])["num_articles"].sum()
+    my_return = collections.OrderedDict()
+    for graph_type, graph_type_totals in totals.groupby(level="graph_type", sort=False):
+        my_return[graph_type] = (graph_type_totals.index.get_level_values("prediction_year").values.astype(float),
+                                 graph_type_totals.values.astype(float))
+    return my_return
 
-    my_color_lookup = graph_type_plus_biorxiv_lookup.loc[graph_type_plus_biorxiv_lookup["name"]==graph_type]
-    my_color = my_color_lookup.iloc[0]["color"]
-    
-    if not ax:
-        fig, ax = plt.subplots(1, 1, figsize=(3, 3), sharex=True, sharey=False)
-    ax.plot(x, y, 'o', color=my_color)
-    ax.set_xlim(2000, 2025)
-    ax.set_ylabel("articles (millions)")
-    ax.set_title("{}".format(graph_type))
-    
-    if curve_type == "no_line":
-        ax.set_xlabel("year of observation")
-        ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: '{0:,.2f}'.format(y/(1000*1000.0))))        
-        return
-    
+# the curves, as functions of an array of years
+def get_curve_function(graph_type, curve_type):
     if curve_type == "linear":
         initial_guess=None
         def func(x, a, b):
@@ -662,16 +1659,175 @@ def curve_fit_with_ci(graph_type, papers_per_year_historical, curve_type, ax=Non
         initial_guess=(1731700, 22962997, -7)
         def func(x, a, b, d):
            return b - a * np.exp((x - 2000)/d) 
+    return (func, initial_guess)
 
-    pars, pcov = curve_fit(func, x, y, initial_guess)
-
-    xfit_extrap = range(2000, 2040+1)
+# their derivatives by each parameter, a column each, so curve_fit doesn't
+# have to estimate them by finite differences
+def get_curve_jacobian(graph_type, curve_type):
     if curve_type == "linear":
-        yfit_extrap = [func(a, pars[0], pars[1]) for a in xfit_extrap]
-        yfit = [func(a, pars[0], pars[1]) for a in x]
+        def jac(x, a, b):
+            return np.stack(np.broadcast_arrays(x - 2000, 1.0), axis=-1)
+    elif curve_type == "exp":
+        start_year = 2014 if graph_type == "biorxiv" else 2000
+        def jac(x, a, b, d):
+            growth = np.exp((x - start_year)/d)
+            return np.stack(np.broadcast_arrays(growth, 1.0, -a * growth * (x - start_year) / d**2), axis=-1)
+    elif curve_type == "negative_exp":
+        def jac(x, a, b, d):
+            growth = np.exp((x - 2000)/d)
+            return np.stack(np.broadcast_arrays(-growth, 1.0, a * growth * (x - 2000) / d**2), axis=-1)
+    return jac
+
+# the fitted curve at years x, for parameters pars, or for each row of pars
+# if it has one per draw
+def evaluate_curve(graph_type, curve_type, pars, x):
+    (func, initial_guess) = get_curve_function(graph_type, curve_type)
+    pars = np.asarray(pars, dtype=float)
+    x = np.asarray(x, dtype=float)
+    if pars.ndim == 1:
+        return func(x, *pars)
+    return func(x[None, :], *[pars[:, [i]] for i in range(pars.shape[1])])
+
+# multi-start fitting, for when the initial guesses above don't suit the data
+# (a new snapshot, another fit window).  for a fixed d, b + a * exp((x - start)/d)
+# is linear in a and b, so the best a and b for each of a grid of d values
+# come from one vectorized least-squares solve.  the best few of those (the
+# lowest point in each dip of the error across the grid) and the initial
+# guess are each refined by curve_fit, and the converged fit with the
+# smallest squared error wins.  the diagnostics have a row per start: where it
+# started and ended, its squared error, whether it converged, and how many
+# function evaluations it took.
+# d keeps the sign of the curve's initial guess, d > 0 for exp and d < 0 for
+# negative_exp: negative_exp with d > 0 (and a < 0) is just exp, so a start or
+# fit with the other sign doesn't count.
+# on with FUTURE_OA_MULTI_START=1, or multi_start=True to fit_extrap_curve.
+fit_multi_start = os.getenv("FUTURE_OA_MULTI_START", "") not in ("", "0")
+# the sizes of d to try
+multi_start_d_grid = np.logspace(-0.5, 3, 200)
+
+def get_multi_start_points(graph_type, curve_type, x, y, num_starts=8):
+    start_year = 2014 if (graph_type == "biorxiv" and curve_type == "exp") else 2000
+    sign = -1.0 if curve_type == "negative_exp" else 1.0
+    d_grid = sign * multi_start_d_grid
+    with np.errstate(over="ignore", divide="ignore", invalid="ignore"):
+        # [d, x]
+        growth = sign * np.exp((x[None, :] - start_year) / d_grid[:, None])
+        growth_centered = growth - growth.mean(axis=1)[:, None]
+        a = (growth_centered * (y - y.mean())[None, :]).sum(axis=1) / (growth_centered**2).sum(axis=1)
+        b = y.mean() - a * growth.mean(axis=1)
+        ss_res = ((y[None, :] - b[:, None] - a[:, None] * growth)**2).sum(axis=1)
+    ss_res[~np.isfinite(ss_res)] = np.inf
+    # the bottoms of the dips, not their neighbours
+    padded = np.concatenate([[np.inf], ss_res, [np.inf]])
+    is_minimum = (ss_res <= padded[:-2]) & (ss_res <= padded[2:]) & np.isfinite(ss_res)
+    best = np.nonzero(is_minimum)[0]
+    best = best[np.argsort(ss_res[best])][:num_starts]
+    return np.column_stack([a[best], b[best], d_grid[best]])
+
+def multi_start_curve_fit(graph_type, curve_type, x, y, num_starts=8):
+    (func, initial_guess) = get_curve_function(graph_type, curve_type)
+    jac = get_curve_jacobian(graph_type, curve_type)
+    starts = np.vstack([initial_guess, get_multi_start_points(graph_type, curve_type, x, y, num_starts)])
+    diagnostics = FrameBuilder()
+    fits = []
+    for start in starts:
+        try:
+            (pars, pcov, infodict, message, ier) = curve_fit(func, x, y, start, jac=jac, full_output=True)
+            converged = ier in (1, 2, 3, 4) and np.all(np.isfinite(pars)) and np.sign(pars[2]) == np.sign(initial_guess[2])
+            num_evaluations = infodict["nfev"]
+        except RuntimeError:
+            (pars, pcov, converged, num_evaluations) = (np.full(len(start), np.nan), None, False, np.nan)
+        ss_res = np.sum((y - func(x, *pars))**2) if converged else np.inf
+        fits.append((ss_res, pars, pcov))
+        diagnostics.add(a_start=start[0], b_start=start[1], d_start=start[2], a=pars[0], b=pars[1], d=pars[2],
+                        ss_res=ss_res, converged=converged, num_evaluations=num_evaluations)
+    diagnostics = diagnostics.build().reset_index(drop=True)
+    if not diagnostics.converged.any():
+        raise RuntimeError("none of the {} starts converged for {} {}".format(len(starts), graph_type, curve_type))
+    best = int(np.argmin([ss_res for (ss_res, pars, pcov) in fits]))
+    diagnostics["best"] = diagnostics.index == best
+    return (fits[best][1], fits[best][2], diagnostics)
+
+# fits curve_type to the totals, without plotting anything.  raises
+# RuntimeError if curve_fit doesn't converge.  the multi-start diagnostics are
+# None for a single start
+def fit_extrap_curve(graph_type, x, y, curve_type, multi_start=None):
+    (func, initial_guess) = get_curve_function(graph_type, curve_type)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if multi_start is None:
+        multi_start = fit_multi_start
+    diagnostics = None
+    if multi_start and initial_guess is not None:
+        (pars, pcov, diagnostics) = multi_start_curve_fit(graph_type, curve_type, x, y)
     else:
-        yfit_extrap = [func(a, pars[0], pars[1], pars[2]) for a in xfit_extrap]
-        yfit = [func(a, pars[0], pars[1], pars[2]) for a in x]
+        pars, pcov = curve_fit(func, x, y, initial_guess, jac=get_curve_jacobian(graph_type, curve_type))
+
+    xfit_extrap = np.arange(2000, extrap_max_year+1)
+    yfit_extrap = evaluate_curve(graph_type, curve_type, pars, xfit_extrap)
+    yfit = evaluate_curve(graph_type, curve_type, pars, x)
+
+    residuals = y - yfit
+    ss_res = np.sum(residuals**2)
+    ss_tot = np.sum((y - np.mean(y))**2)
+    r_squared = 1 - (ss_res / ss_tot)
+
+    extrap = pd.DataFrame({
+        "x": xfit_extrap,
+        "y": yfit_extrap,
+        "r_squared": r_squared
+    })
+    return {
+        "pars": pars,
+        "pcov": pcov,
+        "r_squared": r_squared,
+        "extrap": extrap,
+        "diagnostics": diagnostics
+    }
+
+# every curve type fit to every graph type's totals from get_fit_series, by
+# (graph_type, curve_type).  a fit that doesn't converge is left out
+def fit_curves(fit_series, curve_types, multi_start=None):
+    my_return = collections.OrderedDict()
+    for graph_type, (x, y) in fit_series.items():
+        for curve_type in curve_types:
+            try:
+                my_return[(graph_type, curve_type)] = fit_extrap_curve(graph_type, x, y, curve_type, multi_start)
+            except RuntimeError:
+                pass
+    return my_return
+
+# each fit curve_fit_with_ci makes, by (graph_type, curve_type, fit_years), so
+# its parameters and covariance can be used after it's drawn
+fitted_curves = {}
+
+# Nonlinear curve fit with confidence interval
+def curve_fit_with_ci(graph_type, papers_per_year_historical, curve_type, ax=None, fit_years=(2000, 2018), fit=None):
+    (x, y) = get_fit_data(papers_per_year_historical, fit_years)
+
+    my_color_lookup = graph_type_plus_biorxiv_lookup.loc[graph_type_plus_biorxiv_lookup["name"]==graph_type]
+    my_color = my_color_lookup.iloc[0]["color"]
+    
+    if not ax:
+        fig, ax = plt.subplots(1, 1, figsize=(3, 3), sharex=True, sharey=False)
+    ax.plot(x, y, 'o', color=my_color)
+    ax.set_xlim(2000, 2025)
+    ax.set_ylabel("articles (millions)")
+    ax.set_title("{}".format(graph_type))
+    
+    if curve_type == "no_line":
+        ax.set_xlabel("year of observation")
+        ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: '{0:,.2f}'.format(y/(1000*1000.0))))        
+        return
+
+    if fit is None:
+        fit = fit_extrap_curve(graph_type, x, y, curve_type)
+    fitted_curves[(graph_type, curve_type, tuple(fit_years))] = fit
+    pars = fit["pars"]
+    pcov = fit["pcov"]
+    r_squared = fit["r_squared"]
+    xfit_extrap = list(fit["extrap"]["x"])
+    yfit_extrap = list(fit["extrap"]["y"])
         
     alpha = 0.05 # 95% confidence interval = 100*(1-alpha)
     n = len(y)    # number of data points
@@ -679,11 +1835,6 @@ def curve_fit_with_ci(graph_type, papers_per_year_historical, curve_type, ax=Non
     dof = max(0, n - p) # number of degrees of freedom
     tval = t.ppf(1.0-alpha/2., dof) # student-t value 
 
-    residuals = y - yfit
-    ss_res = np.sum(residuals**2)
-    ss_tot = np.sum((y - np.mean(y))**2)
-    r_squared = 1 - (ss_res / ss_tot)
-    
     fit_string = ""
     for i, p, var in zip(range(n), pars, np.diag(pcov)):
         sigma = var**0.5
@@ -698,12 +1849,7 @@ def curve_fit_with_ci(graph_type, papers_per_year_historical, curve_type, ax=Non
     ax.set_xlabel("r^2={}".format(round(r_squared, 3)))
     if max(yfit_extrap) > 100000:
         ax.yaxis.set_major_formatter(mpl.ticker.FuncFormatter(lambda y, pos: '{0:,.2f}'.format(y/(1000*1000.0))))
-    my_return = pd.DataFrame({
-        "x": xfit_extrap,
-        "y": yfit_extrap,
-        "r_squared": [r_squared for y in yfit_extrap]
-    })
-    return my_return
+    return fit["extrap"]
 
 
 # #### Code: SQL
@@ -713,55 +1859,493 @@ def curve_fit_with_ci(graph_type, papers_per_year_historical, curve_type, ax=Non
 # In[19]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for articles_by_color_by_year_with_embargos and articles_by_color_by_year\n\nq = """\nselect date_part(\'year\', fixed.published_date)::int as published_year, \nfixed.oa_status,\ndelayed.embargo,\ncount(*) as num_articles\nfrom unpaywall u\nleft join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l\njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand published_year > \'1950-01-01\'::timestamp\ngroup by published_year, fixed.oa_status, embargo\norder by published_year asc\n"""\narticles_by_color_by_year_with_embargos = read_from_file_or_db("articles_by_color_by_year_with_embargos", q)\n\narticles_by_color_by_year = articles_by_color_by_year_with_embargos.drop(columns = ["embargo"])\narticles_by_color_by_year = articles_by_color_by_year.groupby([\'published_year\', \'oa_status\']).sum()\narticles_by_color_by_year.reset_index(inplace=True)')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for articles_by_color_by_year_with_embargos and articles_by_color_by_year\n\nq = """\nselect date_part(\'year\', fixed.published_date)::int as published_year, \nfixed.oa_status,\ndelayed.embargo,\ncount(*) as num_articles\nfrom unpaywall u\nleft join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l\njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand published_year > \'1950-01-01\'::timestamp\ngroup by published_year, fixed.oa_status, embargo\norder by published_year asc\n"""\nrollup_dataset_queries["articles_by_color_by_year_with_embargos"] = q')
 
 
 # In[20]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for articles_by_graph_type_by_year\n\nq = """\nselect date_part(\'year\', fixed.published_date) as published_year, \nfixed.oa_status,\ncase when fixed.oa_status=\'bronze\' and delayed.embargo is not null then \'delayed_bronze\' \n    when fixed.oa_status=\'bronze\' and delayed.embargo is null then \'immediate_bronze\' \n    else fixed.oa_status end\n    as graph_type,\ncount(*) as num_articles\nfrom unpaywall u\nleft join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l\njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand published_year > \'1950-01-01\'::timestamp\nand published_year < \'2019-01-01\'::timestamp\ngroup by published_year, fixed.oa_status, graph_type\norder by published_year asc\n"""\narticles_by_graph_type_by_year = read_from_file_or_db("articles_by_graph_type_by_year", q)')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for articles_by_graph_type_by_year\n\nq = """\nselect date_part(\'year\', fixed.published_date) as published_year, \nfixed.oa_status,\ncase when fixed.oa_status=\'bronze\' and delayed.embargo is not null then \'delayed_bronze\' \n    when fixed.oa_status=\'bronze\' and delayed.embargo is null then \'immediate_bronze\' \n    else fixed.oa_status end\n    as graph_type,\ncount(*) as num_articles\nfrom unpaywall u\nleft join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l\njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand published_year > \'1950-01-01\'::timestamp\nand published_year < \'2019-01-01\'::timestamp\ngroup by published_year, fixed.oa_status, graph_type\norder by published_year asc\n"""\nrollup_dataset_queries["articles_by_graph_type_by_year"] = q')
 
 
 # In[21]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for views_by_age_months_no_color_full_year.  maybe don\'t need this one in the final paper?\n\nq = """\nselect datediff(\'days\', fixed.published_date, received_at_raw::timestamp)/30 as article_age_months, \ncount(u.doi) as num_views \nfrom papertrail_unpaywall_extracted extracted \njoin unpaywall u on extracted.doi=u.doi \njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand fixed.published_date > \'1950-01-01\'::timestamp\nand extracted.doi not in (\'10.1038/nature21360\', \'10.1038/nature11723\')\ngroup by article_age_months\norder by article_age_months asc\n\n"""\nviews_by_age_months_no_color_full_year = read_from_file_or_db("views_by_age_months_no_color_full_year", q)')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for views_by_age_months_no_color_full_year.  maybe don\'t need this one in the final paper?\n\nq = """\nselect datediff(\'days\', fixed.published_date, received_at_raw::timestamp)/30 as article_age_months, \ncount(u.doi) as num_views \nfrom papertrail_unpaywall_extracted extracted \njoin unpaywall u on extracted.doi=u.doi \njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand fixed.published_date > \'1950-01-01\'::timestamp\nand extracted.doi not in (\'10.1038/nature21360\', \'10.1038/nature11723\')\ngroup by article_age_months\norder by article_age_months asc\n\n"""\ndataset_queries["views_by_age_months_no_color_full_year"] = q')
 
 
 # In[22]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for views_by_age_months\n# not used by analysis but here for data dump\n\nq = """\nselect datediff(\'days\', fixed.published_date, received_at_raw::timestamp)/30 as article_age_months, \nfixed.oa_status,\ncount(u.doi) as num_views \nfrom papertrail_unpaywall_extracted extracted\njoin unpaywall u on extracted.doi=u.doi \njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand fixed.published_date > \'1950-01-01\'::timestamp\nand fixed.published_date < current_date\nand received_at_raw > \'2019-07-01\'\nand received_at_raw <= \'2019-08-01\'\nand extracted.doi != \'10.1038/nature21360\'\ngroup by article_age_months, fixed.oa_status\norder by article_age_months asc\n"""\nviews_by_age_months = read_from_file_or_db("views_by_age_months", q)\n')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for views_by_age_months, for the monthly model\n\nq = """\nselect datediff(\'days\', fixed.published_date, received_at_raw::timestamp)/30 as article_age_months, \nfixed.oa_status,\ncase when fixed.oa_status=\'bronze\' and journal_issn_l in (select issn_l from journal_delayed_oa_active) then \'delayed\' when fixed.oa_status=\'bronze\' then \'immediate\' else null end as delayed_or_immediate,\ncount(u.doi) as num_views \nfrom papertrail_unpaywall_extracted extracted\njoin unpaywall u on extracted.doi=u.doi \njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand fixed.published_date > \'1950-01-01\'::timestamp\nand fixed.published_date < current_date\nand received_at_raw > \'2019-07-01\'\nand received_at_raw <= \'2019-08-01\'\nand extracted.doi != \'10.1038/nature21360\'\ngroup by article_age_months, fixed.oa_status, delayed_or_immediate\norder by article_age_months asc\n"""\ndataset_queries["views_by_age_months"] = q\n')
 
 
 # In[23]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for views_by_age_years\n\nq = """\nselect datediff(\'days\', fixed.published_date, received_at_raw::timestamp)/(30*12) as article_age_years, \nfixed.oa_status,\ncase when fixed.oa_status=\'bronze\' and journal_issn_l in (select issn_l from journal_delayed_oa_active) then \'delayed\' when fixed.oa_status=\'bronze\' then \'immediate\' else null end as delayed_or_immediate,\ncount(u.doi) as num_views \nfrom papertrail_unpaywall_extracted extracted \njoin unpaywall u on extracted.doi=u.doi \njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand fixed.published_date > \'1950-01-01\'::timestamp\nand fixed.published_date < current_date\nand received_at_raw > \'2019-07-01\'\nand received_at_raw <= \'2019-08-01\'\nand extracted.doi != \'10.1038/nature21360\'\ngroup by article_age_years, fixed.oa_status, delayed_or_immediate\norder by article_age_years asc\n"""\nviews_by_age_years = read_from_file_or_db("views_by_age_years", q)')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for views_by_age_years\n\nq = """\nselect datediff(\'days\', fixed.published_date, received_at_raw::timestamp)/(30*12) as article_age_years, \nfixed.oa_status,\ncase when fixed.oa_status=\'bronze\' and journal_issn_l in (select issn_l from journal_delayed_oa_active) then \'delayed\' when fixed.oa_status=\'bronze\' then \'immediate\' else null end as delayed_or_immediate,\ncount(u.doi) as num_views \nfrom papertrail_unpaywall_extracted extracted \njoin unpaywall u on extracted.doi=u.doi \njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand fixed.published_date > \'1950-01-01\'::timestamp\nand fixed.published_date < current_date\nand received_at_raw > \'2019-07-01\'\nand received_at_raw <= \'2019-08-01\'\nand extracted.doi != \'10.1038/nature21360\'\ngroup by article_age_years, fixed.oa_status, delayed_or_immediate\norder by article_age_years asc\n"""\ndataset_queries["views_by_age_years"] = q')
 
 
 # In[24]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\nq = """\nselect date_part(\'year\', min_record_timestamp) as year_of_first_availability, \ndatediff(\'days\', fixed.published_date, min_record_timestamp)/30 as months_old_at_first_deposit,\ndate_part(\'year\', fixed.published_date) as published_year,\ncount(*) as num_articles\nfrom unpaywall u\njoin unpaywall_pmh_record_min_timestamp pmh on u.doi=pmh.doi\njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere fixed.oa_status = \'green\'\nand genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand year_of_first_availability is not null\ngroup by year_of_first_availability, months_old_at_first_deposit, published_year\n"""\ngreen_oa_with_dates_by_availability = read_from_file_or_db("green_oa_with_dates_by_availability", q)')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\nq = """\nselect date_part(\'year\', min_record_timestamp) as year_of_first_availability, \ndatediff(\'days\', fixed.published_date, min_record_timestamp)/30 as months_old_at_first_deposit,\ndate_part(\'year\', fixed.published_date) as published_year,\ncount(*) as num_articles\nfrom unpaywall u\njoin unpaywall_pmh_record_min_timestamp pmh on u.doi=pmh.doi\njoin unpaywall_updates_view fixed on fixed.doi=u.doi\nwhere fixed.oa_status = \'green\'\nand genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand year_of_first_availability is not null\ngroup by year_of_first_availability, months_old_at_first_deposit, published_year\n"""\ndataset_queries["green_oa_with_dates_by_availability"] = q')
 
 
 # In[25]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# queries delayed_bronze_after_embargos_age_months\n# not used by analysis but here for data dump\n\nmin_prediction_year = 1949\nmax_prediction_year = 2019 + 1\nprediction_year_range = range(min_prediction_year, max_prediction_year)\ndelayed_bronze_after_embargos_age_months = pd.DataFrame()\n\nfor i, prediction_year in enumerate(range(min_prediction_year - 1, max_prediction_year)):\n    \n    q = """\n    select \n    datediff(\'days\', fixed.published_date, \'{prediction_year}-01-01\'::timestamp)/30 as article_age_months, \n    --datediff(\'days\', fixed.published_date, current_date)/30 as article_age_months_from_now, \n    {prediction_year} as prediction_year,\n    count(*) as num_articles\n    from unpaywall u\n    left join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l\n    join unpaywall_updates_view fixed on fixed.doi=u.doi\n    where genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\n    and fixed.oa_status = \'bronze\'\n    and delayed.embargo is not null\n    and fixed.published_date > \'1950-01-01\'::timestamp\n    and fixed.published_date <= ADD_MONTHS(\'{prediction_year}-01-01\'::timestamp, -embargo::integer)\n    group by prediction_year, article_age_months\n    order by prediction_year, article_age_months asc\n    """.format(prediction_year=prediction_year)\n\n    filename_root = "delayed_bronze_sql_parts/{varname}_{index}".format(varname="bronze_rows_by_month", index=i)    \n    bronze_rows = read_from_file_or_db(filename_root, q)\n    \n    delayed_bronze_after_embargos_age_months = delayed_bronze_after_embargos_age_months.append(bronze_rows)\ndelayed_bronze_after_embargos_age_months.to_csv("data/delayed_bronze_after_embargos_age_months.csv")\n')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# query for delayed_bronze_after_embargos_age_months, for every prediction year\n# in one scan: the prediction years are cross joined in rather than queried\n# one at a time.  delayed_bronze_after_embargos_age_years is derived from it.\n\nmin_prediction_year = 1949\nmax_prediction_year = 2019 + 1\nprediction_year_range = range(min_prediction_year, max_prediction_year)\n\nprediction_years_sql = "\\n    union all ".join([\n    "select {prediction_year} as prediction_year, \'{prediction_year}-01-01\'::timestamp as prediction_date".format(prediction_year=prediction_year)\n    for prediction_year in range(min_prediction_year - 1, max_prediction_year)])\n\nq = """\nwith prediction_years as (\n    {prediction_years_sql}\n)\nselect \ndatediff(\'days\', fixed.published_date, prediction_date)/30 as article_age_months, \nprediction_year,\ncount(*) as num_articles\nfrom unpaywall u\nleft join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l\njoin unpaywall_updates_view fixed on fixed.doi=u.doi\ncross join prediction_years\nwhere genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\nand fixed.oa_status = \'bronze\'\nand delayed.embargo is not null\nand fixed.published_date > \'1950-01-01\'::timestamp\nand fixed.published_date <= ADD_MONTHS(prediction_date, -embargo::integer)\ngroup by prediction_year, article_age_months\norder by prediction_year, article_age_months asc\n""".format(prediction_years_sql=prediction_years_sql)\nrollup_dataset_queries["delayed_bronze_sql_parts/bronze_rows_by_month_all"] = q\n\n# the zenodo dump has this as one file per prediction year, from when it was\n# queried a year at a time.  they are the same rows, so use them if they\'re here\ndelayed_bronze_part_varnames = ["delayed_bronze_sql_parts/bronze_rows_by_month_{}".format(i)\n                                for i in range(len(range(min_prediction_year - 1, max_prediction_year)))]\nif not is_query_cached("delayed_bronze_sql_parts/bronze_rows_by_month_all", q) and all([cache_file_exists(varname) for varname in delayed_bronze_part_varnames]):\n    bronze_rows = pd.concat([read_cache_file(varname) for varname in delayed_bronze_part_varnames], ignore_index=True)\n    write_cache_file("delayed_bronze_sql_parts/bronze_rows_by_month_all", bronze_rows)\n    record_cache_entry("delayed_bronze_sql_parts/bronze_rows_by_month_all", get_query_fingerprint(q), num_rows=len(bronze_rows))\n')
 
 
 # In[26]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# queries delayed_bronze_after_embargos_age_years\n\nmin_prediction_year = 1949\nmax_prediction_year = 2019 + 1\nprediction_year_range = range(min_prediction_year, max_prediction_year)\ndelayed_bronze_after_embargos_age_years = pd.DataFrame()\n\nfor i, prediction_year in enumerate(range(min_prediction_year - 1, max_prediction_year)):\n    \n    q = """  \n    select \n    datediff(\'days\', fixed.published_date, \'{prediction_year}-01-01\'::timestamp)/(30*12) as article_age_years, \n    {prediction_year} as prediction_year,\n    count(*) as num_articles\n    from unpaywall u\n    left join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l\n    join unpaywall_updates_view fixed on fixed.doi=u.doi\n    where genre = \'journal-article\' and journal_issn_l not in (\'0849-6757\', \'0931-7597\')\n    and fixed.oa_status = \'bronze\'\n    and delayed.embargo is not null\n    and fixed.published_date > \'1950-01-01\'::timestamp\n    and fixed.published_date <= ADD_MONTHS(\'{prediction_year}-01-01\'::timestamp, -embargo::integer)\n    \n    group by prediction_year, article_age_years\n    order by prediction_year, article_age_years asc\n    """.format(prediction_year=prediction_year)\n\n    filename_root = "delayed_bronze_sql_parts/{varname}_{index}".format(varname="bronze_rows_by_year", index=i)\n    bronze_rows_by_year = read_from_file_or_db(filename_root, q)\n    \n    delayed_bronze_after_embargos_age_years = delayed_bronze_after_embargos_age_years.append(bronze_rows_by_year)\ndelayed_bronze_after_embargos_age_years.to_csv("data/delayed_bronze_after_embargos_age_years.csv")')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\n# delayed_bronze_after_embargos_age_years, from the monthly counts: ages are\n# never negative here, so (days/30)/12 is the same integer as days/(30*12)\n\ndef get_delayed_bronze_age_years(bronze_rows_by_month):\n    bronze_rows_by_year = bronze_rows_by_month.copy()\n    bronze_rows_by_year["article_age_years"] = bronze_rows_by_year["article_age_months"] // 12\n    bronze_rows_by_year = bronze_rows_by_year.groupby(["prediction_year", "article_age_years"], as_index=False)["num_articles"].sum()\n    bronze_rows_by_year = pd.DataFrame(bronze_rows_by_year, columns=["article_age_years", "prediction_year", "num_articles"])\n    return bronze_rows_by_year\n')
 
 
 # In[27]:
 
 
-get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\nq = """select u.year::numeric as published_year, count(distinct u.doi) as num_articles \nfrom unpaywall u\njoin unpaywall u_biorxiv_record on u_biorxiv_record.doi = replace(u.best_url, \'https://doi.org/\', \'\')\nwhere u.doi not like \'10.1101/%\' and u.best_url like \'%10.1101/%\'\nand datediff(\'days\', u_biorxiv_record.published_date::timestamp, u.published_date::timestamp)/(30.0) >= 0\nand u.year >= 2013 and u.year < 2019\ngroup by u.year\norder by u.year desc\n"""\nbiorxiv_growth_otherwise_closed = read_from_file_or_db("biorxiv_growth_otherwise_closed", q)')
+get_ipython().run_cell_magic(u'capture', u'--no-stderr --no-stdout --no-display', u'\nq = """select u.year::numeric as published_year, count(distinct u.doi) as num_articles \nfrom unpaywall u\njoin unpaywall u_biorxiv_record on u_biorxiv_record.doi = replace(u.best_url, \'https://doi.org/\', \'\')\nwhere u.doi not like \'10.1101/%\' and u.best_url like \'%10.1101/%\'\nand datediff(\'days\', u_biorxiv_record.published_date::timestamp, u.published_date::timestamp)/(30.0) >= 0\nand u.year >= 2013 and u.year < 2019\ngroup by u.year\norder by u.year desc\n"""\ndataset_queries["biorxiv_growth_otherwise_closed"] = q')
+
+
+# In[ ]:
+
+
+# the article-level datasets above (articles_by_color_by_year_with_embargos,
+# articles_by_graph_type_by_year and the delayed bronze counts) all scan
+# unpaywall joined to unpaywall_updates_view with the same filters.  instead of
+# running each of them, scan once into article_rollup, the number of articles
+# by published date, oa status and embargo, and group that down to each
+# dataset here.  the get_* functions below have to match the queries they
+# stand in for.
+#
+# a dataset that is already cached (like from the zenodo dump) is read as is,
+# and article_rollup is only queried when one of them isn't.
+
+article_rollup_sql = """
+select fixed.published_date,
+fixed.oa_status,
+delayed.embargo,
+count(*) as num_articles
+from unpaywall u
+left join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l
+join unpaywall_updates_view fixed on fixed.doi=u.doi
+where genre = 'journal-article' and journal_issn_l not in ('0849-6757', '0931-7597')
+and fixed.published_date > '1950-01-01'::timestamp
+group by fixed.published_date, fixed.oa_status, delayed.embargo
+"""
+
+if not all([is_query_cached(varname, rollup_dataset_queries[varname]) for varname in rollup_dataset_queries]):
+    dataset_queries["article_rollup"] = article_rollup_sql
+
+# articles published by the first of each prediction year, by graph type and
+# age in (30 day) months, for the monthly projections.  from 1951, like the
+# yearly counts (published_year > 1950).  it's added after the
+# check above, so article_rollup is only queried for it when the monthly
+# projections first ask for it
+q = """
+with prediction_years as (
+    {prediction_years_sql}
+)
+select 
+datediff('days', fixed.published_date, prediction_date)/30 as article_age_months, 
+prediction_year,
+case when fixed.oa_status='bronze' and delayed.embargo is not null then 'delayed_bronze' 
+    when fixed.oa_status='bronze' and delayed.embargo is null then 'immediate_bronze' 
+    else fixed.oa_status end
+    as graph_type,
+count(*) as num_articles
+from unpaywall u
+left join journal_delayed_oa_active delayed on u.journal_issn_l = delayed.issn_l
+join unpaywall_updates_view fixed on fixed.doi=u.doi
+cross join prediction_years
+where genre = 'journal-article' and journal_issn_l not in ('0849-6757', '0931-7597')
+and fixed.published_date >= '1951-01-01'::timestamp
+and fixed.published_date < prediction_date
+group by prediction_year, article_age_months, graph_type
+order by prediction_year, article_age_months asc
+""".format(prediction_years_sql=prediction_years_sql)
+rollup_dataset_queries["articles_by_graph_type_age_months"] = q
+
+def get_articles_by_color_by_year_with_embargos(article_rollup):
+    my_rollup = article_rollup.assign(published_year=article_rollup.published_date.dt.year)
+    my_rollup = my_rollup.loc[my_rollup.published_year > 1950]
+    return my_rollup.groupby(["published_year", "oa_status", "embargo"], as_index=False, dropna=False)[["num_articles"]].sum()
+
+def get_articles_by_graph_type_by_year(article_rollup):
+    # date_part gives a float year in this one
+    my_rollup = article_rollup.assign(published_year=article_rollup.published_date.dt.year.astype(float))
+    my_rollup = my_rollup.loc[(my_rollup.published_year > 1950) & (my_rollup.published_year < 2019)]
+    my_rollup["graph_type"] = my_rollup.oa_status
+    my_rollup.loc[(my_rollup.oa_status == "bronze") & my_rollup.embargo.notnull(), "graph_type"] = "delayed_bronze"
+    my_rollup.loc[(my_rollup.oa_status == "bronze") & my_rollup.embargo.isnull(), "graph_type"] = "immediate_bronze"
+    return my_rollup.groupby(["published_year", "oa_status", "graph_type"], as_index=False, dropna=False)[["num_articles"]].sum()
+
+# an article counts for a prediction year once its embargo has run out by then,
+# at its age in (30 day) months on the first of that year
+def get_delayed_bronze_age_months(article_rollup):
+    delayed_bronze = article_rollup.loc[(article_rollup.oa_status == "bronze") & article_rollup.embargo.notnull()]
+    published_dates = delayed_bronze.published_date.values.astype("datetime64[ns]")
+    published_days = delayed_bronze.published_date.dt.normalize().values.astype("datetime64[D]")
+    embargo_months = delayed_bronze.embargo.values.astype(int)
+
+    my_dataframes = []
+    for prediction_year in range(min_prediction_year - 1, max_prediction_year):
+        prediction_month = np.datetime64("{}-01".format(prediction_year), "M")
+        embargo_end_dates = (prediction_month - embargo_months).astype("datetime64[ns]")
+        available = published_dates <= embargo_end_dates
+        article_age_days = (prediction_month.astype("datetime64[D]") - published_days[available]).astype(int)
+        my_dataframes.append(pd.DataFrame({
+            "article_age_months": article_age_days // 30,
+            "prediction_year": prediction_year,
+            "num_articles": delayed_bronze.num_articles.values[available]
+        }))
+    my_dataframe = pd.concat(my_dataframes, ignore_index=True)
+    return my_dataframe.groupby(["prediction_year", "article_age_months"], as_index=False)[["num_articles"]].sum()[
+        ["article_age_months", "prediction_year", "num_articles"]]
+
+def get_articles_by_graph_type_age_months(article_rollup):
+    my_rollup = article_rollup.assign(graph_type=article_rollup.oa_status)
+    my_rollup.loc[(my_rollup.oa_status == "bronze") & my_rollup.embargo.notnull(), "graph_type"] = "delayed_bronze"
+    my_rollup.loc[(my_rollup.oa_status == "bronze") & my_rollup.embargo.isnull(), "graph_type"] = "immediate_bronze"
+    my_rollup = my_rollup.groupby(["published_date", "graph_type"], as_index=False)[["num_articles"]].sum()
+    published_dates = my_rollup.published_date.values.astype("datetime64[ns]")
+    published_days = my_rollup.published_date.dt.normalize().values.astype("datetime64[D]")
+
+    my_dataframes = []
+    for prediction_year in range(min_prediction_year - 1, max_prediction_year):
+        prediction_day = np.datetime64("{}-01-01".format(prediction_year), "D")
+        published = (published_dates >= np.datetime64("1951-01-01", "ns")) & (published_dates < prediction_day.astype("datetime64[ns]"))
+        my_dataframes.append(pd.DataFrame({
+            "article_age_months": (prediction_day - published_days[published]).astype(int) // 30,
+            "prediction_year": prediction_year,
+            "graph_type": my_rollup.graph_type.values[published],
+            "num_articles": my_rollup.num_articles.values[published]
+        }))
+    my_dataframe = pd.concat(my_dataframes, ignore_index=True)
+    return my_dataframe.groupby(["prediction_year", "article_age_months", "graph_type"], as_index=False)[["num_articles"]].sum()[
+        ["article_age_months", "prediction_year", "graph_type", "num_articles"]]
+
+# read varname from its cache, else make it from article_rollup with
+# derive_function and cache that as the result of its query
+def read_from_rollup(varname, derive_function):
+    query = rollup_dataset_queries[varname]
+    if is_query_cached(varname, query):
+        return read_from_file_or_db(varname, query)
+    article_rollup = read_from_file_or_db("article_rollup", article_rollup_sql)
+    my_dataframe = derive_function(article_rollup)
+    with cache_lock(varname):
+        write_cache_file(varname, my_dataframe)
+        record_cache_entry(varname, get_query_fingerprint(query), num_rows=len(my_dataframe))
+    return add_sample_standard_errors(my_dataframe)
+
+
+# In[ ]:
+
+
+# run every query above that isn't cached yet, in parallel, before loading
+
+prefetch_datasets(dataset_queries)
+
+
+# In[ ]:
+
+
+# the datasets queried above.  each one is loaded the first time it's asked for
+# with get_dataset(name), so rebuilding one figure only reads the data that
+# figure uses.  get_dataset hands out a view of the loaded dataframe instead of
+# a copy; with copy-on-write, changing it copies just what's changed and
+# leaves the loaded dataset alone.  each dataset has its own lock, so two
+# threads asking for the same one load it once, and a loader can still
+# get_dataset the datasets it's made from.
+
+dataset_loaders = collections.OrderedDict()
+loaded_datasets = {}
+
+def register_dataset(name, loader):
+    dataset_loaders[name] = loader
+    loaded_datasets.pop(name, None)
+    for hook in dataset_change_hooks:
+        hook()
+
+def get_dataset(name):
+    with get_thread_lock("memo/dataset/{}".format(name)):
+        if name not in loaded_datasets:
+            loaded_datasets[name] = dataset_loaders[name]()
+        my_dataframe = loaded_datasets[name]
+    return my_dataframe.copy(deep=False)
+
+# forget the loaded datasets (all of them by default), to reload or free memory
+def unload_datasets(names=None):
+    for name in (names or list(loaded_datasets)):
+        loaded_datasets.pop(name, None)
+    for hook in dataset_change_hooks:
+        hook()
+
+def load_articles_by_color_by_year():
+    articles_by_color_by_year = get_dataset("articles_by_color_by_year_with_embargos").groupby(['published_year', 'oa_status'])[["num_articles"]].sum()
+    articles_by_color_by_year.reset_index(inplace=True)
+    return add_sample_standard_errors(articles_by_color_by_year)
+
+def load_delayed_bronze_after_embargos_age_months():
+    delayed_bronze_after_embargos_age_months = read_from_rollup("delayed_bronze_sql_parts/bronze_rows_by_month_all", get_delayed_bronze_age_months)
+    delayed_bronze_after_embargos_age_months.to_csv(os.path.join(cache_dir, "delayed_bronze_after_embargos_age_months.csv"))
+    return delayed_bronze_after_embargos_age_months
+
+def load_delayed_bronze_after_embargos_age_years():
+    delayed_bronze_after_embargos_age_years = add_sample_standard_errors(get_delayed_bronze_age_years(get_dataset("delayed_bronze_after_embargos_age_months")))
+    delayed_bronze_after_embargos_age_years.to_csv(os.path.join(cache_dir, "delayed_bronze_after_embargos_age_years.csv"))
+    return delayed_bronze_after_embargos_age_years
+
+register_dataset("articles_by_color_by_year_with_embargos", lambda: read_from_rollup("articles_by_color_by_year_with_embargos", get_articles_by_color_by_year_with_embargos))
+register_dataset("articles_by_color_by_year", load_articles_by_color_by_year)
+register_dataset("articles_by_graph_type_by_year", lambda: read_from_rollup("articles_by_graph_type_by_year", get_articles_by_graph_type_by_year))
+register_dataset("articles_by_graph_type_age_months", lambda: read_from_rollup("articles_by_graph_type_age_months", get_articles_by_graph_type_age_months))
+for varname in ["views_by_age_months_no_color_full_year", "views_by_age_months", "views_by_age_years",
+                "green_oa_with_dates_by_availability", "biorxiv_growth_otherwise_closed"]:
+    register_dataset(varname, lambda varname=varname: read_from_file_or_db(varname, dataset_queries[varname]))
+register_dataset("delayed_bronze_after_embargos_age_months", load_delayed_bronze_after_embargos_age_months)
+register_dataset("delayed_bronze_after_embargos_age_years", load_delayed_bronze_after_embargos_age_years)
+
+
+# In[ ]:
+
+
+# the results that take a while to compute from the datasets (the projections,
+# the views totals) are nodes of a pipeline instead of %cache variables.  a
+# node is a function and the arguments to call it with, registered with
+# register_node(name, function, params), and get_node(name) gives back what it
+# returns.
+#
+# each result is kept in memory and pickled to data/pipeline, under a key that
+# hashes everything it was computed from, found by following the names the
+# function uses:
+#   - its params, and its code and the code of every function it calls
+#   - the datasets those functions read with get_dataset("...").  these are
+#     keyed without loading them, on the cache manifest entries of the queries
+#     they're read from and the code of their loaders
+#   - the nodes they read with get_node("...")
+#   - the globals they read: dataframes like final_extraps by their contents,
+#     settings by value
+# so changing a dataset, a fit or a function only recomputes the nodes that
+# depend on it, and everything else is read back, in this session or the next.
+# globals the functions set themselves (memos like extrap_scale_index) aren't
+# inputs.  get_node_inputs(name) lists what a node depends on, and
+# compute_nodes(names) computes several at once on threads, each as soon as
+# the nodes it reads are ready.
+import glob
+import pickle
+import types
+import dis
+
+pipeline_nodes = collections.OrderedDict()
+# name -> (key, value) for the nodes computed or read this session
+node_values = {}
+node_params = {}
+
+def register_node(name, function, params=None):
+    pipeline_nodes[name] = function
+    node_params[name] = dict(params or {})
+    node_values.pop(name, None)
+
+def get_pipeline_filename(name, key):
+    return os.path.join(cache_dir, "pipeline", "{}.{}.pkl".format(name, key))
+
+# returns None for values that aren't inputs (modules, memo dicts, locks)
+def get_value_hash(value):
+    if isinstance(value, (bool, int, float, str, np.generic)):
+        return repr(value)
+    if isinstance(value, (list, tuple)) and all([isinstance(item, (bool, int, float, str, np.generic)) for item in value]):
+        return repr(value)
+    my_hash = hashlib.sha1()
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        labels = list(value.columns) if isinstance(value, pd.DataFrame) else value.name
+        my_hash.update(repr([value.shape, labels, value.dtypes]).encode("utf-8"))
+        try:
+            my_hash.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        except TypeError:
+            my_hash.update(pickle.dumps(value))  # columns holding lists or dicts
+        return my_hash.hexdigest()
+    if isinstance(value, np.ndarray):
+        my_hash.update(repr([value.shape, value.dtype.str]).encode("utf-8"))
+        my_hash.update(np.ascontiguousarray(value).tobytes())
+        return my_hash.hexdigest()
+    return None
+
+# the bytecode, names and constants, but not the file and line numbers, which
+# change whenever a cell is rerun or moved
+def get_code_hash(code):
+    my_hash = hashlib.sha1(code.co_code)
+    my_hash.update(repr([code.co_names, code.co_varnames]).encode("utf-8"))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            my_hash.update(get_code_hash(const).encode("utf-8"))
+        else:
+            my_hash.update(repr(const).encode("utf-8"))
+    return my_hash.hexdigest()
+
+# names the code reads and sets as globals, and the strings in it, including
+# in the functions and comprehensions defined inside it
+def get_code_names(code):
+    names = set(code.co_names)
+    stored_names = set([instruction.argval for instruction in dis.get_instructions(code) if instruction.opname in ("STORE_GLOBAL", "DELETE_GLOBAL")])
+    strings = set([const for const in code.co_consts if isinstance(const, str)])
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            (inner_names, inner_stored_names, inner_strings) = get_code_names(const)
+            names |= inner_names
+            stored_names |= inner_stored_names
+            strings |= inner_strings
+    return (names, stored_names, strings)
+
+# the functions reachable from function, with the names and strings they use.
+# string defaults, like the varname=varname of the dataset loaders, count as
+# strings
+def get_function_inputs(label, function):
+    my_globals = function.__globals__
+    functions = collections.OrderedDict()
+    pending = [(label, function)]
+    names = set()
+    stored_names = set()
+    strings = set()
+    while pending:
+        (function_name, function) = pending.pop()
+        if function_name in functions:
+            continue
+        functions[function_name] = function
+        (code_names, code_stored_names, code_strings) = get_code_names(function.__code__)
+        names |= code_names
+        stored_names |= code_stored_names
+        strings |= code_strings
+        strings |= set([value for value in (function.__defaults__ or ()) if isinstance(value, str)])
+        for code_name in code_names:
+            value = my_globals.get(code_name)
+            if isinstance(value, types.FunctionType) and value.__globals__ is my_globals:
+                pending.append((code_name, value))
+    return (functions, names, stored_names, strings)
+
+def get_function_hash(function_name, function):
+    defaults = [get_value_hash(value) or repr(value) for value in (function.__defaults__ or ())]
+    return u"function {} {} {}\n".format(function_name, get_code_hash(function.__code__), defaults)
+
+# a query's current fingerprint, and the checksum of its cached result if
+# that's from the same query
+def get_query_entry_hash(varname, query):
+    fingerprint = get_query_fingerprint(query)
+    entry = read_cache_manifest().get(varname, {})
+    checksum = entry.get("checksum") if entry.get("fingerprint") == fingerprint else None
+    return u"{} {}".format(fingerprint, checksum)
+
+# the tables made from article_rollup are only cached once they're first
+# loaded, so they're keyed on their query and article_rollup's entry instead
+# of their own, which keeps the key the same before and after
+def get_dataset_hash(name):
+    (functions, names, stored_names, strings) = get_function_inputs("<dataset {}>".format(name), dataset_loaders[name])
+    my_hash = hashlib.sha1(name.encode("utf-8"))
+    for function_name in sorted(functions):
+        my_hash.update(get_function_hash(function_name, functions[function_name]).encode("utf-8"))
+    for varname in sorted(strings & set(dataset_queries)):
+        my_hash.update(u"query {} {}\n".format(varname, get_query_entry_hash(varname, dataset_queries[varname])).encode("utf-8"))
+    if strings & set(rollup_dataset_queries):
+        my_hash.update(u"query article_rollup {}\n".format(get_query_entry_hash("article_rollup", article_rollup_sql)).encode("utf-8"))
+    for varname in sorted(strings & set(rollup_dataset_queries)):
+        my_hash.update(u"rollup {} {}\n".format(varname, get_query_fingerprint(rollup_dataset_queries[varname])).encode("utf-8"))
+    for dataset_name in sorted((strings & set(dataset_loaders)) - set([name])):
+        my_hash.update(u"dataset {} {}\n".format(dataset_name, get_dataset_hash(dataset_name)).encode("utf-8"))
+    return my_hash.hexdigest()
+
+def get_node_inputs(name):
+    my_globals = pipeline_nodes[name].__globals__
+    (functions, names, stored_names, strings) = get_function_inputs("<node {}>".format(name), pipeline_nodes[name])
+
+    my_return = collections.OrderedDict()
+    my_return["functions"] = sorted(functions)
+    my_return["globals"] = sorted([global_name for global_name in names - stored_names - set(functions)
+                                   if global_name in my_globals and get_value_hash(my_globals[global_name]) is not None])
+    my_return["datasets"] = sorted(strings & set(dataset_loaders)) if "get_dataset" in functions else []
+    my_return["nodes"] = sorted((strings & set(pipeline_nodes)) - set([name])) if "get_node" in functions else []
+    return my_return
+
+def get_node_key(name):
+    inputs = get_node_inputs(name)
+    my_globals = pipeline_nodes[name].__globals__
+    my_hash = hashlib.sha1(name.encode("utf-8"))
+    for param_name in sorted(node_params[name]):
+        value = node_params[name][param_name]
+        my_hash.update(u"param {} {}\n".format(param_name, get_value_hash(value) or repr(value)).encode("utf-8"))
+    for function_name in inputs["functions"]:
+        function = pipeline_nodes[name] if function_name.startswith("<node") else my_globals[function_name]
+        my_hash.update(get_function_hash(function_name, function).encode("utf-8"))
+    for global_name in inputs["globals"]:
+        my_hash.update(u"global {} {}\n".format(global_name, get_value_hash(my_globals[global_name])).encode("utf-8"))
+    for dataset_name in inputs["datasets"]:
+        my_hash.update(u"dataset {} {}\n".format(dataset_name, get_dataset_hash(dataset_name)).encode("utf-8"))
+    for node_name in inputs["nodes"]:
+        my_hash.update(u"node {} {}\n".format(node_name, get_node_key(node_name)).encode("utf-8"))
+    return my_hash.hexdigest()
+
+def get_node(name):
+    key = get_node_key(name)
+    with cache_lock("pipeline/{}".format(name)):
+        if name not in node_values or node_values[name][0] != key:
+            filename = get_pipeline_filename(name, key)
+            if os.path.exists(filename):
+                with open(filename, "rb") as node_file:
+                    value = pickle.load(node_file)
+            else:
+                value = pipeline_nodes[name](**node_params[name])
+                def write_function(tmp_filename):
+                    with open(tmp_filename, "wb") as node_file:
+                        pickle.dump(value, node_file, protocol=pickle.HIGHEST_PROTOCOL)
+                write_and_replace(filename, write_function)
+                # only the latest result is kept for each node
+                for old_filename in glob.glob(get_pipeline_filename(name, "*")):
+                    if old_filename != filename:
+                        os.remove(old_filename)
+            node_values[name] = (key, value)
+        value = node_values[name][1]
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    return value
+
+# computes the nodes (all of them by default) on up to max_workers threads,
+# starting each one once the nodes it reads are done
+def compute_nodes(names=None, max_workers=None):
+    names = list(names or pipeline_nodes)
+    node_inputs = {}
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in node_inputs:
+            node_inputs[name] = get_node_inputs(name)["nodes"]
+            pending += node_inputs[name]
+    done = set()
+    with ThreadPoolExecutor(max_workers=max_workers or prefetch_max_workers) as executor:
+        running = {}
+        while len(done) < len(node_inputs):
+            for name in node_inputs:
+                if name not in done and name not in running.values() and set(node_inputs[name]) <= done:
+                    running[executor.submit(get_node, name)] = name
+            future = next(as_completed(running))
+            future.result()
+            done.add(running.pop(future))
+    return collections.OrderedDict((name, get_node(name)) for name in names)
+
+
+# the nodes.  the years they're for are params, so each node can be computed
+# from here.  they're lambdas so they call the functions as they're defined
+# by the time they run, some of them in the cells below.  the curve fits and
+# final_extraps are made by the figure cells in section 4.2, so the nodes read
+# them as globals, which are hashed like any other input
+register_node("all_predicted_papers_future", lambda my_min, my_max: get_all_predicted_papers(my_min, my_max), {"my_min": 1995, "my_max": 2026})
+register_node("views_per_year_total", lambda: get_views_per_year_total())
+register_node("views_per_article_total", lambda: get_views_per_article_total())
+register_node("predicted_views_total", lambda observation_year: get_predicted_views_total(observation_year), {"observation_year": 2025})
+register_node("papers_by_availability_year_total_2018", lambda availability_year: get_papers_by_availability_year_total(availability_year), {"availability_year": 2018})
+register_node("papers_by_availability_year_total_2022", lambda availability_year: get_papers_by_availability_year_total(availability_year), {"availability_year": 2022})
+register_node("predicted_views_by_pubdate_total", lambda observation_year: get_predicted_views_by_pubdate_total(observation_year), {"observation_year": 2022})
 
 
 # *---- delete the text to the line above in the final paper ----*
@@ -902,21 +2486,23 @@ register_new_figure('small-multiples-num-papers-past');
 # start here 
 
 now_year = 2018
-papers_per_year_historical = pd.DataFrame()
+papers_per_year_historical = FrameBuilder()
 for graph_type in graph_type_order:
     for prediction_year in range(1990, now_year+1):        
         papers_per_year = get_papers_by_availability_year(graph_type, prediction_year, just_this_year=True)
         papers_per_year["graph_type"] = graph_type
         papers_per_year["prediction_year"] = prediction_year
-        papers_per_year_historical = papers_per_year_historical.append(papers_per_year)
+        papers_per_year_historical.add(papers_per_year)
+papers_per_year_historical = papers_per_year_historical.build()
         
-papers_per_year_historical_cumulative = pd.DataFrame()
+papers_per_year_historical_cumulative = FrameBuilder()
 for graph_type in graph_type_order:
     for prediction_year in range(1990, now_year+1):        
         papers_per_year = get_papers_by_availability_year(graph_type, prediction_year, just_this_year=False)
         papers_per_year["graph_type"] = graph_type
         papers_per_year["prediction_year"] = prediction_year
-        papers_per_year_historical_cumulative = papers_per_year_historical_cumulative.append(papers_per_year)        
+        papers_per_year_historical_cumulative.add(papers_per_year)        
+papers_per_year_historical_cumulative = papers_per_year_historical_cumulative.build()
 
 
 # In[34]:
@@ -1073,7 +2659,9 @@ register_new_figure('extrap_negative_exp');
 # In[40]:
 
 
-naive_data_all = pd.DataFrame()
+naive_fits = FrameBuilder()
+# all 18 fits, made before any of them are drawn
+naive_curve_fits = fit_curves(get_fit_series(papers_per_year_historical), ["linear", "exp", "negative_exp"])
 
 curve_type="linear"
 fig, axes = plt.subplots(1, len(graph_type_order), figsize=(12, 2), sharex=True, sharey=False)
@@ -1084,10 +2672,10 @@ plt.subplots_adjust(hspace=1)
 for i, graph_type in enumerate(graph_type_order):
     curve_type_display = curve_type
     data_for_plot = papers_per_year_historical.loc[papers_per_year_historical.graph_type==graph_type]
-    new_data = curve_fit_with_ci(graph_type, data_for_plot, curve_type=curve_type_display, ax=axes_flatten[i])
+    new_data = curve_fit_with_ci(graph_type, data_for_plot, curve_type=curve_type_display, ax=axes_flatten[i], fit=naive_curve_fits.get((graph_type, curve_type)))
     new_data["curve_type"] = curve_type
     new_data["graph_type"] = graph_type
-    naive_data_all = naive_data_all.append(new_data)
+    naive_fits.add(new_data)
 
 plt.show()
 
@@ -1108,10 +2696,10 @@ plt.subplots_adjust(hspace=1)
 for i, graph_type in enumerate(graph_type_order):
     curve_type_display = curve_type
     data_for_plot = papers_per_year_historical.loc[papers_per_year_historical.graph_type==graph_type]
-    new_data = curve_fit_with_ci(graph_type, data_for_plot, curve_type=curve_type_display, ax=axes_flatten[i])
+    new_data = curve_fit_with_ci(graph_type, data_for_plot, curve_type=curve_type_display, ax=axes_flatten[i], fit=naive_curve_fits.get((graph_type, curve_type)))
     new_data["curve_type"] = curve_type
     new_data["graph_type"] = graph_type
-    naive_data_all = naive_data_all.append(new_data)
+    naive_fits.add(new_data)
 
 plt.show()
 
@@ -1132,10 +2720,10 @@ plt.subplots_adjust(hspace=1)
 for i, graph_type in enumerate(graph_type_order):
     curve_type_display = curve_type
     data_for_plot = papers_per_year_historical.loc[papers_per_year_historical.graph_type==graph_type]
-    new_data = curve_fit_with_ci(graph_type, data_for_plot, curve_type=curve_type_display, ax=axes_flatten[i])
+    new_data = curve_fit_with_ci(graph_type, data_for_plot, curve_type=curve_type_display, ax=axes_flatten[i], fit=naive_curve_fits.get((graph_type, curve_type)))
     new_data["curve_type"] = curve_type
     new_data["graph_type"] = graph_type
-    naive_data_all = naive_data_all.append(new_data)
+    naive_fits.add(new_data)
 
 plt.show()
 
@@ -1147,12 +2735,14 @@ plt.show()
 # In[43]:
 
 
-final_extraps = pd.DataFrame()
-final_extraps = final_extraps.append(naive_data_all.loc[(naive_data_all.graph_type == "delayed_bronze") & (naive_data_all.curve_type=="negative_exp")])
-final_extraps = final_extraps.append(naive_data_all.loc[(naive_data_all.graph_type == "closed") & (naive_data_all.curve_type=="negative_exp")])
-final_extraps = final_extraps.append(naive_data_all.loc[(naive_data_all.graph_type != "delayed_bronze") &
-                                                        (naive_data_all.graph_type != "closed") & 
-                                                        (naive_data_all.curve_type=="exp")])
+naive_data_all = naive_fits.build()
+final_extraps = pd.concat([
+    naive_data_all.loc[(naive_data_all.graph_type == "delayed_bronze") & (naive_data_all.curve_type=="negative_exp")],
+    naive_data_all.loc[(naive_data_all.graph_type == "closed") & (naive_data_all.curve_type=="negative_exp")],
+    naive_data_all.loc[(naive_data_all.graph_type != "delayed_bronze") &
+                       (naive_data_all.graph_type != "closed") & 
+                       (naive_data_all.curve_type=="exp")]
+])
 
 
 # In[44]:
@@ -1170,14 +2760,14 @@ register_new_figure('small-multiples-num-papers-future');
 
 
 def get_all_predicted_papers(my_min, my_max):
-    all_predicted_papers = pd.DataFrame()
+    all_predicted_papers = FrameBuilder()
     for i, graph_type in enumerate(graph_type_order):
         all_data = get_papers_by_availability_year_including_future(graph_type, my_min, my_max)
         all_data["graph_type"] = graph_type
-        all_predicted_papers = all_predicted_papers.append(all_data)
-    return all_predicted_papers
+        all_predicted_papers.add(all_data)
+    return all_predicted_papers.build()
 
-get_ipython().magic(u'cache all_predicted_papers_future = get_all_predicted_papers(1995, 2026)')
+all_predicted_papers_future = get_node("all_predicted_papers_future")
 
 
 # In[46]:
@@ -1386,9 +2976,12 @@ register_new_figure("view-by-age-no-color");
 
 
 # hidden: code to query and graph 
-get_ipython().magic(u'matplotlib inline')
+# (headless, figures are drawn off screen instead)
+if not headless:
+    get_ipython().magic(u'matplotlib inline')
 
-my_data = views_by_age_months_no_color_full_year.loc[views_by_age_months_no_color_full_year.article_age_months >= 0]
+my_data = get_dataset("views_by_age_months_no_color_full_year")
+my_data = my_data.loc[my_data.article_age_months >= 0]
 my_data = my_data.loc[my_data.article_age_months <= 12*15]
 fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(8, 2), sharex=True, sharey=False)
 plt.tight_layout(pad=0, w_pad=2, h_pad=1)
@@ -1431,7 +3024,7 @@ register_new_figure("views_by_age_with_color");
 # In[54]:
 
 
-get_ipython().magic(u'cache views_per_year_total = get_views_per_year_total()')
+views_per_year_total = get_node("views_per_year_total")
 data_now = views_per_year_total.loc[views_per_year_total["article_age_years"] >= 0]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
 kws = dict(linewidth=5)
@@ -1458,7 +3051,20 @@ register_new_figure("views-by-article-main");
 # In[56]:
 
 
+# the views per article curves only change when the datasets do, so each one
+# is worked out once.  callers get a view of it
+views_per_article_curves = {}
+
 def get_views_per_article(graph_type):
+    with get_thread_lock("memo/views_per_article/{}".format(graph_type)):
+        if graph_type not in views_per_article_curves:
+            views_per_article_curves[graph_type] = compute_views_per_article(graph_type)
+        my_dataframe = views_per_article_curves[graph_type]
+    return my_dataframe.copy(deep=False)
+
+dataset_change_hooks.append(views_per_article_curves.clear)
+
+def compute_views_per_article(graph_type):
     if graph_type == "biorxiv":
         graph_type = "green"
         
@@ -1475,27 +3081,27 @@ def get_views_per_article(graph_type):
 
     if graph_type=="delayed_bronze":
         # otherwise first one is too high because number articles too low in year 0 for delayed subset
-        views_per_article.loc[views_per_article.article_age_years==0, ["views_per_article"]] = float(views_per_article.loc[views_per_article.article_age_years==1].views_per_article)
+        views_per_article.loc[views_per_article.article_age_years==0, ["views_per_article"]] = float(views_per_article.loc[views_per_article.article_age_years==1].views_per_article.iloc[0])
 
     return views_per_article
 
 def get_views_per_article_total():
-    all_data = pd.DataFrame()
+    all_data = FrameBuilder()
     for prep_graph_type in ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]:
         temp_papers = get_views_per_article(prep_graph_type)
 #         print prep_graph_type
 #         print "{:,.0f}".format(temp_papers.views_per_article.max()), "{:,.0f}".format(temp_papers.views_per_article.sum())
 #         print "\n"
         temp_papers["graph_type"] = prep_graph_type
-        all_data = all_data.append(temp_papers)
-    return all_data
+        all_data.add(temp_papers)
+    return all_data.build()
 
 
 # In[57]:
 
 
 
-get_ipython().magic(u'cache views_per_article_total = get_views_per_article_total()')
+views_per_article_total = get_node("views_per_article_total")
 data_now = views_per_article_total.loc[views_per_article_total["article_age_years"] >= 0]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
 kws = dict(s=50)
@@ -1536,47 +3142,543 @@ g.axes.flat[0].set_ylabel("views per article");
 # In[58]:
 
 
-def get_predicted_views(graph_type, now_delta_years=0, label_for_graph=None, show_graph=True):
+# the max of each row's convolution of win with sig, over the window
+# signal.convolve(mode="same") keeps: for a row of length n (padded out with
+# zeros after that), the n values starting at (n-1)//2.  the max is taken the
+# way max() goes through the window: a nan first value wins, later nans are
+# passed over.  the [row, output, position] products are made a chunk of rows
+# at a time, to keep them small for long (monthly) rows.
+def convolve_same_max(win, sig, lengths, chunk_size=64):
+    positions = np.arange(win.shape[1])
+    views = np.zeros(len(lengths))
+    for chunk_start in range(0, len(lengths), chunk_size):
+        rows = np.arange(chunk_start, min(chunk_start + chunk_size, len(lengths)))
+        row_lengths = lengths[rows][:, None, None]
+        outputs = ((lengths[rows] - 1) // 2)[:, None] + positions[None, :]
+        shifts = outputs[:, :, None] - positions[None, None, :]
+        # leave out the padding, so an inf in win doesn't meet a padded 0
+        in_row = (shifts >= 0) & (shifts < row_lengths) & (positions[None, None, :] < row_lengths)
+        products = win[rows][:, None, :] * sig[rows[:, None, None], np.clip(shifts, 0, win.shape[1] - 1)]
+        convolved = np.where(in_row, products, 0).sum(axis=2)
+        kept = positions[None, :] < lengths[rows][:, None]
+        views[rows] = np.where(kept & ~np.isnan(convolved), convolved, -np.inf).max(axis=1)
+        views[rows[np.isnan(convolved[:, 0])]] = np.nan
+    return views
+
+# views by observation year for each graph type, all in one go.  for each
+# (graph type, year), the articles by age and the views per article at the
+# same ages go in a row of two padded arrays, and all the rows are convolved
+# at once
+def get_predicted_views_batch(graph_types, calc_min_year=1995, max_year=2025):
+    merged = FrameBuilder()
+    for graph_index, graph_type in enumerate(graph_types):
+        views_per_article = get_views_per_article(graph_type)
+        all_papers_per_year = get_papers_by_availability_year_including_future(graph_type, calc_min_year, max_year)
+        all_papers_per_year = all_papers_per_year.loc[(all_papers_per_year["prediction_year"] >= calc_min_year) &
+                                                      (all_papers_per_year["prediction_year"] <= max_year)]
+        data_merged_clean = all_papers_per_year.merge(views_per_article, left_on=["article_years_from_availability"], right_on=["article_age_years"])
+        merged.add(pd.DataFrame({
+            "graph_index": graph_index,
+            "prediction_year": data_merged_clean["prediction_year"].values,
+            "article_age_years": data_merged_clean["article_age_years"].values,
+            "views_per_article": data_merged_clean["views_per_article"].values.astype(float),
+            "num_articles": data_merged_clean["num_articles"].values.astype(float)
+        }))
+    merged = merged.build()
+    if merged.empty:
+        return pd.DataFrame({"observation_year": [], "views": [], "graph_type": []})
+    merged = merged.sort_values(["graph_index", "prediction_year", "article_age_years"])
+
+    groups = merged.groupby(["graph_index", "prediction_year"], sort=True)
+    row_indexes = groups.ngroup().values
+    column_indexes = groups.cumcount().values
+    keys = groups.size()
+    lengths = keys.values
+    win = np.zeros((len(keys), lengths.max()))
+    sig = np.zeros((len(keys), lengths.max()))
+    win[row_indexes, column_indexes] = merged["views_per_article"].values
+    sig[row_indexes, column_indexes] = merged["num_articles"].values
+
+    graph_indexes = keys.index.get_level_values("graph_index").values
+    my_return = pd.DataFrame({
+        "observation_year": keys.index.get_level_values("prediction_year").values,
+        "views": convolve_same_max(win, sig, lengths),
+        "graph_type": np.array(graph_types, dtype=object)[graph_indexes]
+    }, index=np.zeros(len(keys), dtype=int))
+    return my_return
+
+def get_predicted_views(graph_type):
 #     calc_min_year = 1951
     calc_min_year = 1995
-    display_min_year = 2010
-    now_year = 2020 - now_delta_years
     max_year = 2025
-    exponential = False
+    my_return = get_predicted_views_batch([graph_type], calc_min_year, max_year)
+    return my_return[["observation_year", "views"]]
 
-    if graph_type == "biorxiv":
-        exponential = True
-        
-    views_per_article = get_views_per_article(graph_type)
-           
-    df_views_by_year = pd.DataFrame()
-    all_papers_per_year = get_papers_by_availability_year_including_future(graph_type, calc_min_year, max_year)
-    for prediction_year in range(calc_min_year, max_year+1):        
-#     for prediction_year in range(calc_min_year, 2019):        
-#     for prediction_year in range(2017, 2019):        
-        papers_per_year = all_papers_per_year.loc[all_papers_per_year["prediction_year"] == prediction_year]
-#         print views_per_article.head()
-        try:
-            data_merged_clean = papers_per_year.merge(views_per_article, left_on=["article_years_from_availability"], right_on=["article_age_years"])
-            data_merged_clean = data_merged_clean.sort_values("article_age_years")
-            win = data_merged_clean["views_per_article"] 
-            sig = data_merged_clean["num_articles"]
-            views_by_observation_year = signal.convolve(win, sig, mode='same', method="direct")
-            y = max(views_by_observation_year)
-            df_views_by_year = df_views_by_year.append(pd.DataFrame({"observation_year":[prediction_year], "views": [y]}))
-        except (ValueError, KeyError):  # happens when the year is blank
-            pass
-        
+def get_predicted_views_total(observation_year):
+    return get_predicted_views_batch(graph_type_order, max_year=observation_year)
 
-    return df_views_by_year
 
-def get_predicted_views_total(observation_year):
-    all_data = pd.DataFrame()
-    for prep_graph_type in graph_type_order:
-        temp_papers = get_predicted_views(prep_graph_type, observation_year)
-        temp_papers["graph_type"] = prep_graph_type
-        all_data = all_data.append(temp_papers)
-    return all_data
+# In[ ]:
+
+
+# monthly resolution: the same projections with article ages in (30 day)
+# months instead of years.  everything is a dense [graph type, year, age in
+# months] array, and each year counts what the yearly model counts for it:
+#   - gold, hybrid and immediate bronze published by the end of the year, so
+#     their ages are on the first of the next
+#   - delayed bronze whose embargo is up by the first of the year, from
+#     delayed_bronze_after_embargos_age_months the way the yearly one is
+#   - green deposited by the end of the year.  the green data only has the
+#     year an article was published, so each year's articles are spread evenly
+#     over its twelve months
+#   - closed is the yearly closed for each published year since 1990, spread
+#     over that year's months the way all its articles are, and the same for
+#     each cohort from then on
+#   - biorxiv only has yearly counts, so it isn't here
+# future years are projected the way get_papers_by_availability_year_including_future
+# does it, a year (12 months) older each year, and views per article come from
+# views_by_age_months, with bronze split into immediate and delayed the way
+# get_views_per_year does.  check_monthly_totals checks the articles each year
+# add up to the yearly ones.
+monthly_graph_types = ["gold", "hybrid", "green", "immediate_bronze", "delayed_bronze", "closed"]
+monthly_max_age_months = 12*15
+monthly_views_year = 2018
+monthly_tensor = None
+
+def get_monthly_tensor():
+    global monthly_tensor
+    if monthly_tensor is None:
+        monthly_tensor = build_monthly_tensor()
+    return monthly_tensor
+
+def invalidate_monthly_tensor():
+    global monthly_tensor
+    monthly_tensor = None
+
+dataset_change_hooks.append(invalidate_monthly_tensor)
+
+def build_monthly_tensor():
+    published = get_dataset("articles_by_graph_type_age_months")
+    delayed_bronze = get_dataset("delayed_bronze_after_embargos_age_months")
+    green = get_dataset("green_oa_with_dates_by_availability")
+    # published by the end of a year is published by the first of the next
+    years = np.arange(published["prediction_year"].min() - 1, published["prediction_year"].max())
+    oldest_green_days = (np.datetime64("{}-01-01".format(years[-1] + 1)) - np.datetime64("{}-01-01".format(int(green["published_year"].min())))).astype(int)
+    ages = np.arange(0, max(published["article_age_months"].max(), delayed_bronze["article_age_months"].max(), oldest_green_days // 30) + 1)
+
+    num_articles = np.zeros((len(monthly_graph_types), len(years), len(ages)))
+    total = np.zeros((len(years), len(ages)))
+    def add_counts(counts_by_age, prediction_years, article_ages, counts):
+        prediction_years = np.asarray(prediction_years).astype(int)
+        article_ages = np.asarray(article_ages).astype(int)
+        keep = (prediction_years >= years[0]) & (prediction_years <= years[-1]) & (article_ages >= 0) & (article_ages <= ages[-1])
+        np.add.at(counts_by_age, (prediction_years[keep] - years[0], article_ages[keep]), np.asarray(counts, dtype=float)[keep])
+
+    add_counts(total, published["prediction_year"] - 1, published["article_age_months"], published["num_articles"])
+    for graph_type in ["gold", "hybrid", "immediate_bronze"]:
+        rows = published.loc[published["graph_type"] == graph_type]
+        add_counts(num_articles[monthly_graph_types.index(graph_type)], rows["prediction_year"] - 1, rows["article_age_months"], rows["num_articles"])
+    add_counts(num_articles[monthly_graph_types.index("delayed_bronze")], delayed_bronze["prediction_year"],
+               delayed_bronze["article_age_months"], delayed_bronze["num_articles"])
+
+    # green: deposited by the end of the year, at the age each month of its
+    # published year would be on the first of the next, or 0 if it's deposited
+    # before it's published.  [green row, year, month published]
+    green = green.loc[(green["months_old_at_first_deposit"] >= -24) & (green["months_old_at_first_deposit"] <= 12*25)]
+    green = green.loc[green["published_year"].notnull() & green["year_of_first_availability"].notnull()]
+    green = green.groupby([green["year_of_first_availability"].astype(int), green["published_year"].astype(int)])["num_articles"].sum()
+    first_years = green.index.get_level_values(0).values
+    published_months = ((green.index.get_level_values(1).values - 1970) * 12)[:, None] + np.arange(12)[None, :]
+    published_days = published_months.astype("datetime64[M]").astype("datetime64[D]")
+    prediction_days = ((years + 1 - 1970) * 12).astype("datetime64[M]").astype("datetime64[D]")
+    green_ages = np.maximum((prediction_days[None, :, None] - published_days[:, None, :]).astype(int) // 30, 0)
+    shape = green_ages.shape
+    available = np.broadcast_to((first_years[:, None] <= years[None, :])[:, :, None], shape)
+    add_counts(num_articles[monthly_graph_types.index("green")],
+               np.broadcast_to(years[None, :, None], shape)[available],
+               green_ages[available],
+               np.broadcast_to((green.values / 12.0)[:, None, None], shape)[available])
+
+    # closed: the yearly closed of each published year, at the ages under 12
+    # months that year's articles have at its first count, in the same
+    # proportions.  then the same articles a year (12 months) older each year
+    cohorts = get_cohort_tensor()
+    closed_by_year = cohorts["num_articles_this_year"][cohorts["graph_types"].index("closed"), :, list(cohorts["ages"]).index(0)]
+    closed_by_year = pd.Series(closed_by_year, index=cohorts["years"]).reindex(years, fill_value=0).values.astype(float)
+    closed_by_year[years < closed_min_year] = 0
+    first_count = total[:, :12]
+    first_count_total = first_count.sum(axis=1)
+    closed = np.zeros((len(years), len(ages)))
+    closed[:, :12] = closed_by_year[:, None] * first_count / np.where(first_count_total > 0, first_count_total, 1)[:, None]
+    for year_index in range(1, len(years)):
+        closed[year_index, 12:] = closed[year_index - 1, :-12]
+    num_articles[monthly_graph_types.index("closed")] = closed
+
+    return {
+        "graph_types": monthly_graph_types,
+        "years": years,
+        "ages": ages,
+        "num_articles": num_articles
+    }
+
+# the monthly arrays through end_year.  after now_year, each year what was
+# age a in now_year is age a + 12k after k years, with
+#     all[a] + sum over j=1..k of scale[j] * new[a + 12j]
+# where new is what's open in now_year that wasn't a year before, and scale
+# is how much the extrapolated curve has grown, the same as for the yearly
+# projections.  new is counted by year of age (up to 10), like the yearly
+# just_this_year counts, since a year older isn't always exactly 12 (30 day)
+# months older, and each year's is spread over its months the way all is
+def get_monthly_projection(now_year=2017, end_year=2025):
+    cohorts = get_monthly_tensor()
+    years = cohorts["years"]
+    now_index = now_year - years[0]
+    num_years = max(end_year - now_year, 0)
+    num_ages = len(cohorts["ages"])
+    past = cohorts["num_articles"][:, :min(end_year, now_year) - years[0] + 1]
+    if not num_years:
+        return {"graph_types": cohorts["graph_types"], "years": years[:past.shape[1]], "ages": cohorts["ages"], "num_articles": past}
+
+    all_now = cohorts["num_articles"][:, now_index]
+    new_by_month = all_now.copy()
+    new_by_month[:, 12:] -= cohorts["num_articles"][:, now_index - 1, :-12]
+    num_graph_types = len(all_now)
+    new_ages = 12 * 11
+    new_by_age_year = new_by_month[:, :new_ages].reshape(num_graph_types, 11, 12).sum(axis=2)
+    new_by_age_year[new_by_age_year < 25] = 0
+    all_by_age_year = all_now[:, :new_ages].reshape(num_graph_types, 11, 12)
+    all_totals = all_by_age_year.sum(axis=2, keepdims=True)
+    weights = np.where(all_totals > 0, all_by_age_year / np.where(all_totals > 0, all_totals, 1), 1 / 12.0)
+    new = np.zeros(all_now.shape)
+    new[:, :new_ages] = (new_by_age_year[:, :, None] * weights).reshape(num_graph_types, new_ages)
+
+    future_years = np.arange(now_year + 1, end_year + 1)
+    scales = np.array([get_extrap_curve(graph_type, future_years) for graph_type in cohorts["graph_types"]])
+    scales /= np.array([int(get_extrap_curve(graph_type, [now_year])[0]) for graph_type in cohorts["graph_types"]])[:, None]
+
+    # starting ages from -12*num_years, so rows that are new after now_year fit
+    offset = 12 * num_years
+    starting = np.arange(num_ages + 2 * offset)
+    steps = np.arange(1, num_years + 1)
+    padded_new = np.zeros((len(new), num_ages + 3 * offset))
+    padded_new[:, offset:offset + num_ages] = new
+    padded_all = np.zeros((len(new), num_ages + 2 * offset))
+    padded_all[:, offset:offset + num_ages] = all_now
+    added = np.cumsum(scales[:, :, None] * padded_new[:, starting[None, :] + 12 * steps[:, None]], axis=1)
+
+    # [graph type, future year, age]
+    future_ages = np.arange(num_ages + offset)
+    starting_indexes = future_ages[None, :] - 12 * steps[:, None] + offset
+    future = padded_all[:, starting_indexes] + np.take_along_axis(added, np.broadcast_to(starting_indexes, added.shape[:1] + starting_indexes.shape), axis=2)
+
+    num_articles = np.zeros((len(new), past.shape[1] + num_years, num_ages + offset))
+    num_articles[:, :past.shape[1], :num_ages] = past
+    num_articles[:, past.shape[1]:] = future
+    return {
+        "graph_types": cohorts["graph_types"],
+        "years": np.append(years[:past.shape[1]], future_years),
+        "ages": future_ages,
+        "num_articles": num_articles
+    }
+
+def get_papers_by_availability_month_including_future(graph_type, start_year, end_year):
+    projection = get_monthly_projection(end_year=end_year)
+    years = projection["years"]
+    keep = years >= start_year
+    counts = projection["num_articles"][projection["graph_types"].index(graph_type), keep]
+    year_indexes, age_indexes = np.nonzero(counts)
+    return pd.DataFrame({
+        "article_months_from_availability": projection["ages"][age_indexes],
+        "num_articles": counts[year_indexes, age_indexes],
+        "prediction_year": years[keep][year_indexes]
+    })
+
+# views per article by age in months, [graph type, age]: a year of views (12
+# times the one month in views_by_age_months) over the articles at that age
+def get_views_per_article_monthly():
+    cohorts = get_monthly_tensor()
+    views_by_age_months = get_dataset("views_by_age_months")
+    ages = np.arange(monthly_max_age_months)
+    articles = cohorts["num_articles"][:, monthly_views_year - cohorts["years"][0], :monthly_max_age_months]
+    views_per_article = np.zeros((len(cohorts["graph_types"]), monthly_max_age_months))
+    for i, graph_type in enumerate(cohorts["graph_types"]):
+        if "bronze" in graph_type:
+            views = views_by_age_months.loc[(views_by_age_months.oa_status == "bronze") &
+                                            (views_by_age_months.delayed_or_immediate == graph_type.split("_")[0])]
+        else:
+            views = views_by_age_months.loc[views_by_age_months.oa_status == graph_type]
+        views = 12.0 * views.groupby(views["article_age_months"].astype(int))["num_views"].sum().reindex(ages, fill_value=0).values
+        views_per_article[i, :articles.shape[1]] = np.where(articles[i] > 0, views[:articles.shape[1]] / np.where(articles[i] > 0, articles[i], 1), 0)
+    return views_per_article
+
+# views by observation year for each graph type, at monthly resolution: every
+# (graph type, year) is a row of 180 months, all convolved at once
+def get_predicted_views_monthly(calc_min_year=1995, max_year=2025):
+    projection = get_monthly_projection(end_year=max_year)
+    views_per_article = get_views_per_article_monthly()
+    keep = (projection["years"] >= calc_min_year) & (projection["years"] <= max_year)
+    sig = projection["num_articles"][:, keep, :monthly_max_age_months]
+    win = np.broadcast_to(views_per_article[:, None, :sig.shape[2]], sig.shape)
+    num_graph_types, num_years, num_ages = sig.shape
+    views = convolve_same_max(win.reshape(-1, num_ages), sig.reshape(-1, num_ages), np.full(num_graph_types * num_years, num_ages))
+    return pd.DataFrame({
+        "observation_year": np.tile(projection["years"][keep], num_graph_types),
+        "views": views,
+        "graph_type": np.repeat(np.array(projection["graph_types"], dtype=object), num_years)
+    })
+
+# the monthly articles, summed over every age, against the yearly ones for each
+# graph type and year.  they count the same articles, so check_monthly_totals
+# raises if any year is further apart than tolerance
+def get_monthly_totals_vs_yearly(start_year=2000, end_year=2025):
+    projection = get_monthly_projection(end_year=end_year)
+    totals = FrameBuilder()
+    for i, graph_type in enumerate(projection["graph_types"]):
+        yearly = get_papers_by_availability_year_including_future(graph_type, start_year, end_year)
+        yearly = yearly.loc[yearly["prediction_year"] >= start_year].groupby("prediction_year")["num_articles"].sum()
+        monthly = pd.Series(projection["num_articles"][i].sum(axis=1), index=projection["years"])
+        totals.add(pd.DataFrame({
+            "graph_type": graph_type,
+            "year": yearly.index.values,
+            "monthly": monthly.reindex(yearly.index).values,
+            "yearly": yearly.values.astype(float)
+        }))
+    totals = totals.build()
+    totals["ratio"] = totals["monthly"] / totals["yearly"]
+    return totals
+
+def check_monthly_totals(start_year=2000, end_year=2025, tolerance=0.01):
+    totals = get_monthly_totals_vs_yearly(start_year, end_year)
+    off = totals.loc[~((totals["ratio"] - 1).abs() <= tolerance)]
+    if len(off):
+        raise RuntimeError("monthly totals are more than {:.1%} off the yearly ones:\n{}".format(tolerance, off.to_string(index=False)))
+    return totals
+
+
+# In[ ]:
+
+
+# the projections past the paper's 2025, through extrap_max_year or any later
+# end_year (get_extrap_curve extends the curves).  both the articles and the
+# views are closed forms in the number of years ahead (see
+# project_papers_by_availability_year and get_predicted_views_batch), so a
+# longer horizon is just longer arrays, not more steps.  one row for each
+# graph type and observation year: articles available, views, and each one's
+# share of that year's total
+def get_long_horizon_projection(start_year=2000, end_year=None):
+    end_year = end_year or extrap_max_year
+    papers = FrameBuilder()
+    for graph_type in graph_type_order:
+        all_papers_per_year = get_papers_by_availability_year_including_future(graph_type, start_year, end_year)
+        all_papers_per_year = all_papers_per_year.groupby("prediction_year", as_index=False)["num_articles"].sum()
+        papers.add(pd.DataFrame({
+            "graph_type": graph_type,
+            "observation_year": all_papers_per_year["prediction_year"].values,
+            "num_articles": all_papers_per_year["num_articles"].values
+        }))
+    papers = papers.build()
+    views = get_predicted_views_batch(graph_type_order, start_year, end_year)
+    my_return = papers.merge(views, on=["graph_type", "observation_year"], how="outer")
+    my_return = my_return.loc[(my_return["observation_year"] >= start_year) & (my_return["observation_year"] <= end_year)]
+    for column in ["num_articles", "views"]:
+        my_return[column + "_share"] = my_return[column] / my_return.groupby("observation_year")[column].transform("sum")
+    return my_return.sort_values(["observation_year", "graph_type"]).reset_index(drop=True)
+
+
+# In[ ]:
+
+
+# how much the 2025 numbers depend on the curves picked for final_extraps, and
+# on the years they were fit to.  a scenario is a curve type for each graph
+# type plus a window of observation years to fit them all to.  a graph type's
+# articles and views only use its own curve, so each (graph type, curve type,
+# fit window) is projected just once, on a process pool, and each scenario's
+# totals are sums of those: the 3 windows and 3**6 curve assignments below are
+# 2187 scenarios from 54 projections.
+#
+# run_scenario_sweep() gives a row per scenario: the fit window, the curve type
+# for each graph type, the worst r^2 among its fits, and the OA share of the
+# articles available and of the views in outcome_year.  is_final marks the
+# scenario the paper uses.  scenarios with a fit that doesn't converge get no
+# shares.
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+scenario_curve_types = ["linear", "exp", "negative_exp"]
+scenario_fit_windows = [(2000, 2018), (2005, 2018), (2010, 2018)]
+# what final_extraps uses, from section 4.2.2
+final_curve_types = {
+    "green": "exp",
+    "gold": "exp",
+    "hybrid": "exp",
+    "immediate_bronze": "exp",
+    "delayed_bronze": "negative_exp",
+    "closed": "negative_exp",
+    "biorxiv": "exp"
+}
+final_fit_window = (2000, 2018)
+
+# r^2, articles available and views in outcome_year for one graph type, with
+# its curve swapped into final_extraps just while it's projected
+def compute_scenario_part(graph_type, curve_type, fit_years, outcome_year):
+    global final_extraps
+    (x, y) = get_fit_data(papers_per_year_historical.loc[papers_per_year_historical.graph_type==graph_type], fit_years)
+    try:
+        fit = fit_extrap_curve(graph_type, x, y, curve_type)
+    except RuntimeError:
+        return (np.nan, np.nan, np.nan)
+    extrap = fit["extrap"]
+    extrap["curve_type"] = curve_type
+    extrap["graph_type"] = graph_type
+
+    saved_final_extraps = final_extraps
+    final_extraps = pd.concat([final_extraps.loc[final_extraps.graph_type != graph_type], extrap])
+    try:
+        papers = get_papers_by_availability_year_including_future(graph_type, outcome_year, outcome_year)
+        views = get_predicted_views_batch([graph_type], outcome_year, outcome_year)
+    finally:
+        final_extraps = saved_final_extraps
+    num_articles = papers.loc[papers.prediction_year == outcome_year, "num_articles"].sum()
+    return (fit["r_squared"], num_articles, views["views"].sum())
+
+def run_scenario_sweep(curve_types=None, fit_windows=None, outcome_year=2025, max_workers=None):
+    curve_types = curve_types or scenario_curve_types
+    fit_windows = fit_windows or scenario_fit_windows
+    parts = list(itertools.product(graph_type_order, curve_types, fit_windows))
+    arguments = [list(values) for values in zip(*parts)] + [[outcome_year] * len(parts)]
+
+    # worked out once here, rather than again in every worker
+    get_cohort_tensor()
+    for graph_type in graph_type_order:
+        get_views_per_article(graph_type)
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        # the workers are forks of this session, so they start out with its
+        # functions and datasets
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+            results = list(executor.map(compute_scenario_part, *arguments, chunksize=4))
+    else:
+        results = [compute_scenario_part(*part_arguments) for part_arguments in zip(*arguments)]
+    # [graph type, curve type, fit window, (r^2, articles, views)]
+    results = np.array(results, dtype=float).reshape(len(graph_type_order), len(curve_types), len(fit_windows), 3)
+
+    # [scenario, graph type] -> which curve type
+    assignments = np.array(list(itertools.product(range(len(curve_types)), repeat=len(graph_type_order))))
+    graph_indexes = np.arange(len(graph_type_order))[None, :]
+    is_open = np.array([graph_type != "closed" for graph_type in graph_type_order])
+    final_assignment = np.array([curve_types.index(final_curve_types[graph_type]) if final_curve_types[graph_type] in curve_types else -1
+                                 for graph_type in graph_type_order])
+
+    my_return = FrameBuilder()
+    for window_index, fit_years in enumerate(fit_windows):
+        scenario_results = results[graph_indexes, assignments, window_index]
+        (r_squared, num_articles, views) = (scenario_results[:, :, 0], scenario_results[:, :, 1], scenario_results[:, :, 2])
+        columns = collections.OrderedDict()
+        columns["fit_years"] = "{}-{}".format(fit_years[0], fit_years[1] - 1)
+        for graph_index, graph_type in enumerate(graph_type_order):
+            columns[graph_type] = np.array(curve_types, dtype=object)[assignments[:, graph_index]]
+        columns["min_r_squared"] = r_squared.min(axis=1)
+        columns["articles_oa_share"] = num_articles[:, is_open].sum(axis=1) / num_articles.sum(axis=1)
+        columns["views_oa_share"] = views[:, is_open].sum(axis=1) / views.sum(axis=1)
+        columns["is_final"] = (tuple(fit_years) == final_fit_window) & np.all(assignments == final_assignment, axis=1)
+        my_return.add(**columns)
+    return my_return.build().reset_index(drop=True)
+
+
+# In[ ]:
+
+
+# how sure the projections are, given how sure the growth curves are.  the
+# parameters of each curve in final_extraps are drawn num_draws times from the
+# normal distribution its fit's covariance describes, and all the draws go
+# through the article and views projections together: the curves are
+# evaluated for every draw as one array, project_num_articles takes a row of
+# scales per draw, and the views for every draw and year are one call of
+# convolve_same_max.  graph types are drawn independently, and draw i of each
+# graph type together make draw i of the shares.
+#
+# get_projection_bands() has a row for every graph type (and "oa", the open
+# types together), projected observation year and series (num_articles,
+# views and each one's share of the year's total), with the estimate from the
+# fitted parameters, and the mean and percentiles of the draws.  a draw with a
+# curve at or below 0 in now_year gives no numbers, and is left out.
+projection_band_percentiles = [2.5, 50, 97.5]
+
+# the fit behind a curve in final_extraps: the one curve_fit_with_ci made, or
+# the same fit made again if it hasn't been run
+def get_final_curve_fit(graph_type):
+    key = (graph_type, final_curve_types[graph_type], final_fit_window)
+    if key not in fitted_curves:
+        (x, y) = get_fit_data(papers_per_year_historical.loc[papers_per_year_historical.graph_type==graph_type], final_fit_window)
+        fitted_curves[key] = fit_extrap_curve(graph_type, x, y, final_curve_types[graph_type])
+    return fitted_curves[key]
+
+# [draw, year] values of the curve, the first draw with the fitted parameters
+# and the rest with random ones
+def draw_curves(graph_type, years, num_draws, rng):
+    fit = get_final_curve_fit(graph_type)
+    pcov = fit["pcov"]
+    if not np.all(np.isfinite(pcov)):
+        pcov = np.zeros_like(pcov)  # curve_fit couldn't estimate it
+    draws = np.vstack([fit["pars"], rng.multivariate_normal(fit["pars"], pcov, size=num_draws, method="eigh")])
+    return evaluate_curve(graph_type, final_curve_types[graph_type], draws, years)
+
+# [draw, year] articles available and views, for the years after now_year
+def get_projection_draws(graph_type, end_year, num_draws, rng):
+    now_year = 2017  # the last year get_papers_by_availability_year_including_future doesn't project
+    prediction_years = np.arange(now_year + 1, end_year + 1)
+    curves = draw_curves(graph_type, np.append(now_year, prediction_years), num_draws, rng)
+    scales = curves[:, 1:] / np.trunc(curves[:, [0]])
+    current_year_all = get_papers_by_availability_year(graph_type, now_year, just_this_year=False)
+    now_year_new = get_papers_by_availability_year(graph_type, now_year, just_this_year=True)
+    (num_articles, present, ages) = project_num_articles(scales, current_year_all, now_year_new)
+    articles = np.where(present, num_articles, 0).sum(axis=-1)
+
+    # the same rows get_predicted_views_batch would convolve: the ages with
+    # both articles and views per article, youngest first
+    views_per_article = get_views_per_article(graph_type).set_index("article_age_years")["views_per_article"]
+    has_views = present & np.isin(ages, views_per_article.index.values)
+    lengths = has_views.sum(axis=1)
+    (year_indexes, age_indexes) = np.nonzero(has_views)
+    column_indexes = (np.cumsum(has_views, axis=1) - 1)[has_views]
+    win = np.zeros((len(prediction_years), lengths.max()))
+    win[year_indexes, column_indexes] = views_per_article.reindex(ages[has_views]).values.astype(float)
+    sig = np.zeros((len(curves), len(prediction_years), lengths.max()))
+    sig[:, year_indexes, column_indexes] = num_articles[:, year_indexes, age_indexes]
+    views = convolve_same_max(np.broadcast_to(win, sig.shape).reshape(-1, win.shape[1]), sig.reshape(-1, win.shape[1]),
+                              np.tile(lengths, len(curves)), chunk_size=512)
+    return (prediction_years, articles, views.reshape(len(curves), -1))
+
+def get_projection_bands(end_year=2025, num_draws=2000, percentiles=None, seed=0):
+    percentiles = percentiles or projection_band_percentiles
+    rng = np.random.default_rng(seed)
+    draws = collections.OrderedDict([("num_articles", []), ("views", [])])
+    for graph_type in graph_type_order:
+        (years, articles, views) = get_projection_draws(graph_type, end_year, num_draws, rng)
+        draws["num_articles"].append(articles)
+        draws["views"].append(views)
+
+    is_open = np.array([graph_type != "closed" for graph_type in graph_type_order])
+    names = graph_type_order + ["oa"]
+    my_return = FrameBuilder()
+    for series in list(draws):
+        # [graph type, draw, year]
+        values = np.stack(draws[series])
+        values = np.concatenate([values, values[is_open].sum(axis=0)[None]])
+        totals = values[:-1].sum(axis=0)
+        for (series_name, series_values) in [(series, values), (series + "_share", values / totals[None])]:
+            for name, name_values in zip(names, series_values):
+                columns = collections.OrderedDict()
+                columns["graph_type"] = name
+                columns["observation_year"] = years
+                columns["series"] = series_name
+                columns["estimate"] = name_values[0]
+                columns["mean"] = np.nanmean(name_values[1:], axis=0)
+                for percentile, percentile_values in zip(percentiles, np.nanpercentile(name_values[1:], percentiles, axis=0)):
+                    columns["p{:g}".format(percentile)] = percentile_values
+                my_return.add(**columns)
+    return my_return.build().reset_index(drop=True)
 
 
 # In[59]:
@@ -1589,7 +3691,7 @@ register_new_figure("views-small-main");
 
 
 observation_year = 2025
-get_ipython().magic(u'cache predicted_views_total = get_predicted_views_total(observation_year)')
+predicted_views_total = get_node("predicted_views_total")
 
 data_now = predicted_views_total.loc[predicted_views_total["observation_year"] >= 2010]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
@@ -1710,7 +3812,7 @@ display(Markdown(my_markdown))
 # In[104]:
 
 
-biorxiv_growth_otherwise_closed
+get_dataset("biorxiv_growth_otherwise_closed")
 
 
 # In[65]:
@@ -1729,12 +3831,15 @@ biorxiv_now_year = 2018
 # reset
 papers_per_year_historical = papers_per_year_historical.loc[papers_per_year_historical.graph_type != 'biorxiv']
 
+biorxiv_historical = FrameBuilder()
+biorxiv_historical.add(papers_per_year_historical)
 for graph_type in ["biorxiv"]:
     for prediction_year in range(2000, biorxiv_now_year+1):        
         papers_per_year = get_papers_by_availability_year(graph_type, prediction_year, just_this_year=True)
         papers_per_year["graph_type"] = graph_type
         papers_per_year["prediction_year"] = prediction_year
-        papers_per_year_historical = papers_per_year_historical.append(papers_per_year)
+        biorxiv_historical.add(papers_per_year)
+papers_per_year_historical = biorxiv_historical.build()
 
 
 # In[67]:
@@ -1749,7 +3854,7 @@ new_data = curve_fit_with_ci("biorxiv", data_for_plot, curve_type="exp", ax=ax)
 new_data["curve_type"] = "exp"
 new_data["graph_type"] = "biorxiv"
 final_extraps = final_extraps.loc[final_extraps.graph_type != 'biorxiv']
-final_extraps = final_extraps.append(new_data)
+final_extraps = pd.concat([final_extraps, new_data])
 ax.set_xlim(2012, 2025)
 ax.set_yscale("log")
 ax.set_ylabel("articles (log scale)");
@@ -1773,7 +3878,7 @@ all_predicted_papers_future_plus_biorxiv = all_predicted_papers_future.copy()
 biorxiv_predicted_papers = get_papers_by_availability_year_including_future("biorxiv", 1995, 2026)
 biorxiv_predicted_papers["graph_type"] = "biorxiv"
 
-all_predicted_papers_future_plus_biorxiv = all_predicted_papers_future_plus_biorxiv.append(biorxiv_predicted_papers)
+all_predicted_papers_future_plus_biorxiv = pd.concat([all_predicted_papers_future_plus_biorxiv, biorxiv_predicted_papers])
 
 
 articles_by_obs_year_df_plus_biorxiv = all_predicted_papers_future_plus_biorxiv.copy()
@@ -1799,10 +3904,10 @@ register_new_figure("biorxiv-stacked");
 
 
 total_views_including_biorxiv = predicted_views_total.copy()
-biorxiv_views = get_predicted_views("biorxiv", 2010, 2025)
+biorxiv_views = get_predicted_views("biorxiv")
 biorxiv_views["graph_type"] = "biorxiv"
 biorxiv_views["oa_status"] = "biorxiv"
-total_views_including_biorxiv = total_views_including_biorxiv.append(biorxiv_views)
+total_views_including_biorxiv = pd.concat([total_views_including_biorxiv, biorxiv_views])
 
 
 # In[72]:
@@ -2143,7 +4248,7 @@ make_zoom_in_plot("delayed_bronze")
 # In[83]:
 
 
-get_ipython().magic(u'cache views_per_year_total = get_views_per_year_total()')
+views_per_year_total = get_node("views_per_year_total")
 data_now = views_per_year_total.loc[views_per_year_total["article_age_years"] >= 0]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
 kws = dict(linewidth=5)
@@ -2168,7 +4273,7 @@ register_new_figure("num-papers-by-age-2018");
 # In[85]:
 
 
-get_ipython().magic(u'cache papers_by_availability_year_total_2018 = get_papers_by_availability_year_total(2018)')
+papers_by_availability_year_total_2018 = get_node("papers_by_availability_year_total_2018")
 data_now = papers_by_availability_year_total_2018.loc[papers_by_availability_year_total_2018["article_years_from_availability"] < 15]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
 my_dict = {"width": 1, "edgecolor": (0,0,0,0)}
@@ -2197,7 +4302,7 @@ register_new_figure("views-by-article");
 
 
 
-get_ipython().magic(u'cache views_per_article_total = get_views_per_article_total()')
+views_per_article_total = get_node("views_per_article_total")
 data_now = views_per_article_total.loc[views_per_article_total["article_age_years"] >= 0]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
 kws = dict(s=50)
@@ -2240,7 +4345,7 @@ register_new_figure('num-articles-2022');
 
 
 my_year = 2022
-get_ipython().magic(u'cache papers_by_availability_year_total_2022 = get_papers_by_availability_year_total(my_year)')
+papers_by_availability_year_total_2022 = get_node("papers_by_availability_year_total_2022")
 data_now = papers_by_availability_year_total_2022.loc[papers_by_availability_year_total_2022["article_years_from_availability"] < 15]
 data_now["publication_year"] = my_year - data_now["article_years_from_availability"]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
@@ -2264,7 +4369,7 @@ register_new_figure("views-per-article2");
 
 
 
-get_ipython().magic(u'cache views_per_article_total = get_views_per_article_total()')
+views_per_article_total = get_node("views_per_article_total")
 data_now = views_per_article_total.loc[views_per_article_total["article_age_years"] >= 0]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
 kws = dict(s=50)
@@ -2287,7 +4392,7 @@ register_new_figure("views-by-article-year-2022");
 
 
 
-get_ipython().magic(u'cache predicted_views_by_pubdate_total = get_predicted_views_by_pubdate_total(my_year)')
+predicted_views_by_pubdate_total = get_node("predicted_views_by_pubdate_total")
 data_now = predicted_views_by_pubdate_total.loc[predicted_views_by_pubdate_total["article_age_years"] < 15]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
 kws = dict(alpha=0.25, linewidth=8)
@@ -2317,7 +4422,7 @@ register_new_figure("views-small");
 
 
 observation_year = 2025
-get_ipython().magic(u'cache predicted_views_total = get_predicted_views_total(observation_year)')
+predicted_views_total = get_node("predicted_views_total")
 
 data_now = predicted_views_total.loc[predicted_views_total["observation_year"] >= 2010]
 g = sns.FacetGrid(data_now, col="graph_type", hue="graph_type", col_order=graph_type_order, hue_order=graph_type_order, palette=my_cmap_graph_type)
@@ -2347,12 +4452,13 @@ fig, axes = plt.subplots(1, len(graph_type_order), figsize=(13, 3), sharex=True,
 axes_flatten = axes.flatten()
 plt.tight_layout(pad=0, w_pad=2, h_pad=1)
 plt.subplots_adjust(hspace=1)
-prediction_of_views = pd.DataFrame()
+prediction_of_views = FrameBuilder()
 for i, graph_type in enumerate(graph_type_order):
     predicted_views_this_graph = predicted_views_total.loc[predicted_views_total.graph_type==graph_type]
     new_data = graph_views(graph_type, data=predicted_views_this_graph, ax=axes_flatten[i])
     new_data["graph_type"] = graph_type
-    prediction_of_views = prediction_of_views.append(new_data)
+    prediction_of_views.add(new_data)
+prediction_of_views = prediction_of_views.build()
 
 
 # **{{print figure_link("views-large")}}: Views by year, full scale**
@@ -2365,7 +4471,7 @@ for i, graph_type in enumerate(graph_type_order):
 
 
 register_new_figure("articles_by_simple_colors");
-articles_by_simple_colors_df = articles_by_color_by_year.copy()
+articles_by_simple_colors_df = get_dataset("articles_by_color_by_year")
 articles_by_simple_colors_df = articles_by_simple_colors_df.rename(
     columns={"published_year": "x",
              "num_articles": "y",